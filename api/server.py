@@ -0,0 +1,324 @@
+# api/server.py
+"""
+Headless HTTP API for Dark AI: the same ChatSession store and turn pipeline
+as the Streamlit app, served over ASGI with Server-Sent Events streaming.
+
+    uvicorn api.server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST   /chats                    {"role": ..., "title"?, settings...} -> chat
+    GET    /chats                    -> [{"id", "title"}]
+    GET    /chats/{id}               -> chat with messages
+    DELETE /chats/{id}
+    POST   /chats/{id}/messages      {"content": ..., "stream"?: true, ...}
+    GET    /healthz, GET /metrics
+
+Message sends stream `text/event-stream` events: `stage` (start/end with
+seconds), `delta` (new answer text; a `revise_answer` stream replaces the
+draft), `clarification` (questions instead of an answer), `error`, and a
+final `done` with the reply and per-stage metrics. With "stream": false
+the same payload as `done` comes back as JSON.
+
+Use CHAT_STORE=sqlite when running more than one worker so every worker
+sees the same chats. The 409 "already being answered" check is per worker;
+across workers the store appends each exchange after the last logged message
+(never over it), so concurrent sends to one chat are all kept, though neither
+turn sees the other's exchange. Set API_TOKEN to require
+`Authorization: Bearer <token>`.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Literal, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+from utils.chat_store import ChatSession, chat_state, make_chat_store, new_chat
+from utils.metrics import render_prometheus
+from utils.pipeline import PipelineHooks, TurnContext, arun_turn
+from utils.reasoning import anchored_history
+from utils.summarizer import update_summary
+
+app = FastAPI(title="Dark AI API")
+
+store = make_chat_store()
+# Blocking LLM/search calls run here; the event loop only relays events
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("API_WORKER_THREADS", "32")), thread_name_prefix="dark-ai-api")
+_chat_locks: Dict[str, asyncio.Lock] = {}  # one turn at a time per chat (per worker; the store guards appends)
+Depth = Literal["Fast", "Standard", "Deep", "Auto"]
+
+
+class ChatSettings(BaseModel):
+    """
+    Chat settings a client may set; the rolling-summary fields are server-managed.
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    temperature: float = Field(None, ge=0.0, le=2.0)
+    top_p: float = Field(None, ge=0.0, le=1.0)
+    use_web_search: bool = None
+    web_results_per_query: int = Field(None, ge=1, le=10)
+    web_extract_chars: int = Field(None, ge=300, le=2000)
+    web_fetch_pages: bool = None
+    reasoning_depth: Depth = None
+    speculative_plan: bool = None
+    planner_mode: Literal["split", "merged"] = None
+    speculative_search: bool = None
+    memory_mode: Literal["window", "summary"] = None
+
+
+class ChatCreate(BaseModel):
+    role: str = Field(..., min_length=1)
+    title: Optional[str] = None
+    settings: ChatSettings = Field(default_factory=ChatSettings)  # e.g. {"reasoning_depth": "Deep"}
+
+
+class MessageSend(BaseModel):
+    content: str = Field(..., min_length=1)
+    stream: bool = True
+    depth: Optional[Depth] = None          # overrides the chat's reasoning_depth for this turn
+    web: Optional[bool] = None             # overrides use_web_search for this turn
+    use_search_cache: bool = True
+    after_clarification: bool = False      # this message answers our clarifying questions
+
+
+def require_token(authorization: Optional[str] = Header(default=None)) -> None:
+    token = os.getenv("API_TOKEN")
+    if token and authorization != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="invalid or missing bearer token")
+
+
+def _chat_json(chat: ChatSession, messages: bool = False) -> Dict:
+    out = {"id": chat.id, "title": chat.title, "role": chat.role, "created_at": chat.created_at,
+           "settings": chat_state(chat)}
+    if messages:
+        out["messages"] = chat.messages
+    return out
+
+
+async def _load(chat_id: str) -> ChatSession:
+    chat = await asyncio.get_running_loop().run_in_executor(executor, store.load_chat, chat_id)
+    if chat is None:
+        raise HTTPException(status_code=404, detail="chat not found")
+    return chat
+
+
+def _release(chat_id: str, lock: asyncio.Lock) -> None:
+    lock.release()
+    if not lock.locked():
+        _chat_locks.pop(chat_id, None)
+
+
+def _sse(event: str, data: Dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class QueueHooks(PipelineHooks):
+    """
+    Turns pipeline callbacks (on the event loop) into SSE events.
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.sent: Dict[str, int] = {}  # stage -> chars already sent
+
+    def on_stage_start(self, stage, ctx):
+        self.queue.put_nowait(("stage", {"stage": stage, "status": "start"}))
+
+    def on_delta(self, stage, text):
+        new = text[self.sent.get(stage, 0):]
+        if new:
+            self.sent[stage] = len(text)
+            self.queue.put_nowait(("delta", {"stage": stage, "text": new}))
+
+    def on_stage_end(self, stage, ctx, elapsed):
+        self.queue.put_nowait(("stage", {"stage": stage, "status": "end", "seconds": round(elapsed, 3)}))
+
+    def on_error(self, stage, ctx, exc):
+        self.queue.put_nowait(("error", {"stage": stage, "message": str(exc)}))
+
+
+def _rollback(chat: ChatSession) -> None:
+    """
+    Drop this turn's unsaved messages (the memory store hands out live chats).
+    """
+    del chat.messages[chat.persisted_count:]
+
+
+def _summarize_and_save(chat: ChatSession) -> None:
+    if update_summary(chat):
+        store.save_chat(chat)
+
+
+def _turn_context(chat: ChatSession, body: MessageSend) -> TurnContext:
+    return TurnContext(
+        role=chat.role,
+        user_text=body.content,
+        history=anchored_history(chat.role, chat.messages_for_model(max_pairs=40), body.after_clarification),
+        depth=body.depth or chat.reasoning_depth,
+        after_clarification=body.after_clarification,
+        do_web=chat.use_web_search if body.web is None else body.web,
+        use_search_cache=body.use_search_cache,
+        web_results_per_query=chat.web_results_per_query,
+        web_extract_chars=chat.web_extract_chars,
+        web_fetch_pages=chat.web_fetch_pages,
+        search_deadline=float(os.getenv("WEB_SEARCH_DEADLINE", "12")),
+        speculative_plan=chat.speculative_plan,
+        planner_mode=chat.planner_mode,
+        speculative_search=chat.speculative_search,
+        temperature=chat.temperature,
+        top_p=chat.top_p,
+    )
+
+
+def _reply(ctx: TurnContext) -> str:
+    if ctx.clarification:
+        qs = "\n".join(f"{i}) {q}" for i, q in enumerate(ctx.clarification["questions"], start=1))
+        return (
+            "To give you the most accurate, role-aligned answer, I need a few details:\n\n"
+            f"{qs}\n\n_Reply with the answers (you can be brief)._"
+        )
+    return ctx.final_text
+
+
+async def _finish(chat: ChatSession, ctx: TurnContext) -> Dict:
+    """
+    Persist the exchange and build the `done` payload. An empty reply is an
+    error and is not saved.
+    """
+    reply = _reply(ctx)
+    if not reply.strip():
+        raise RuntimeError("the pipeline produced no reply")
+    chat.messages.append({"role": "assistant", "content": reply})
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, store.sync, chat)
+    if not ctx.clarification and chat.memory_mode == "summary":
+        loop.run_in_executor(executor, _summarize_and_save, chat)  # after the reply, not awaited
+    return {
+        "chat_id": chat.id,
+        "reply": reply,
+        "clarification": ctx.clarification,
+        "depth": ctx.depth,
+        "depth_reason": ctx.depth_reason,
+        "sources": [{"title": r.title, "url": r.url} for r in ctx.results],
+        "metrics": {"stages": ctx.metrics.rows(), "totals": ctx.metrics.totals()},
+    }
+
+
+# -------------------- Routes --------------------
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_prometheus()
+
+
+@app.post("/chats", status_code=201, dependencies=[Depends(require_token)])
+async def create_chat(body: ChatCreate):
+    chat = new_chat(body.role)
+    if body.title:
+        chat.title = body.title[:60]
+    for k, v in body.settings.model_dump(exclude_unset=True).items():
+        setattr(chat, k, v)
+    await asyncio.get_running_loop().run_in_executor(executor, store.sync, chat)
+    return _chat_json(chat)
+
+
+@app.get("/chats", dependencies=[Depends(require_token)])
+async def list_chats():
+    rows = await asyncio.get_running_loop().run_in_executor(executor, store.list_chats)
+    return [{"id": cid, "title": title} for cid, title in rows]
+
+
+@app.get("/chats/{chat_id}", dependencies=[Depends(require_token)])
+async def get_chat(chat_id: str):
+    return _chat_json(await _load(chat_id), messages=True)
+
+
+@app.delete("/chats/{chat_id}", status_code=204, dependencies=[Depends(require_token)])
+async def delete_chat(chat_id: str):
+    await asyncio.get_running_loop().run_in_executor(executor, store.delete_chat, chat_id)
+
+
+@app.post("/chats/{chat_id}/messages", dependencies=[Depends(require_token)])
+async def send_message(chat_id: str, body: MessageSend):
+    lock = _chat_locks.setdefault(chat_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="a message is already being answered in this chat")
+    await lock.acquire()
+    try:
+        chat = await _load(chat_id)
+        chat.messages.append({"role": "user", "content": body.content})
+        ctx = _turn_context(chat, body)
+    except BaseException:
+        _release(chat_id, lock)
+        raise
+
+    if not body.stream:
+        try:
+            await arun_turn(ctx, executor=executor)
+            return await _finish(chat, ctx)
+        except asyncio.CancelledError:
+            _rollback(chat)
+            raise
+        except Exception as e:
+            _rollback(chat)
+            raise HTTPException(status_code=500, detail=str(e) or type(e).__name__)
+        finally:
+            _release(chat_id, lock)
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        try:
+            await arun_turn(ctx, QueueHooks(queue), executor=executor)
+            if ctx.clarification:
+                queue.put_nowait(("clarification", ctx.clarification))
+            queue.put_nowait(("done", await _finish(chat, ctx)))
+        except asyncio.CancelledError:
+            _rollback(chat)
+            raise
+        except Exception as e:
+            _rollback(chat)
+            queue.put_nowait(("error", {"stage": "turn", "message": str(e) or type(e).__name__}))
+        finally:
+            queue.put_nowait(None)
+
+    def settle(task: asyncio.Task) -> None:
+        # Runs even if the task was cancelled before it started or the
+        # response never began streaming, so the lock can't leak
+        if task.cancelled():
+            _rollback(chat)
+        _release(chat_id, lock)
+
+    # Started here rather than in events(), which only runs once the response streams
+    task = asyncio.create_task(run())
+    task.add_done_callback(settle)
+
+    async def events():
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield _sse(*item)
+        finally:
+            # Client went away: stop the turn instead of generating into the void
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api.server:app", host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")),
+                workers=int(os.getenv("API_WORKERS", "1")))
@@ -2,19 +2,22 @@ import os
 import json
 import streamlit as st
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
-from time import sleep
+from typing import Optional
+from time import monotonic
 from datetime import datetime
-
-from utils.azure_client import stream_chat_completion  # Must yield (text, finish_reason)
-from utils.chat_store import new_chat, ChatSession
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.reasoning import anchored_history, generate_dark_quote, generate_funky_greeting
+from utils.pipeline import PipelineHooks, TurnContext, run_turn
+from utils.chat_store import new_chat, ChatSession, ChatStore, MemoryChatStore, make_chat_store
+from utils.summarizer import update_summary
+from utils.flair_pool import FlairPool
+from utils.metrics import start_metrics_server
+from utils.routing import get_router
 from streamlit_js_eval import streamlit_js_eval  # for browser local time
 
 # Import Navbar Component
-from navbar_component import render_navbar
-
-# NEW: web search helper
-from utils.web_search import web_search, format_results_for_prompt
+from navbar_component import inject_navbar_styles, render_navbar
 
 load_dotenv(override=True)
 
@@ -22,6 +25,8 @@ load_dotenv(override=True)
 st.set_page_config(page_title="Dark AI", page_icon="💬", layout="wide")
 
 # -------------------- Global compact styling --------------------
+# Re-emitted on every full rerun (Streamlit drops elements a run doesn't
+# send); fragment reruns below don't re-run this, so it costs nothing there.
 st.markdown(
     """
     <style>
@@ -46,7 +51,7 @@ st.markdown(
 
 # -------------------- Session Bootstrapping --------------------
 if "chats" not in st.session_state:
-    st.session_state.chats = {}  # id -> ChatSession
+    st.session_state.chats = {}  # id -> ChatSession (loaded lazily from the chat store)
 if "active_chat_id" not in st.session_state:
     st.session_state.active_chat_id = None
 if "creating_chat" not in st.session_state:
@@ -64,246 +69,180 @@ if "browser_hour" not in st.session_state:
 # Clarification state per chat
 if "clarify_state" not in st.session_state:
     st.session_state.clarify_state = {}  # { chat_id: {"awaiting": bool, "questions": list[str], "asked_at": str } }
+if "history_older" not in st.session_state:
+    st.session_state.history_older = {}  # { chat_id: number of older messages paged in }
+if "browser_tz_offset" not in st.session_state:
+    st.session_state.browser_tz_offset = None  # minutes, as JS Date.getTimezoneOffset()
 # Developer debug toggle (hidden by default)
 if "dev_show_plan" not in st.session_state:
     st.session_state.dev_show_plan = False
+if "dev_show_metrics" not in st.session_state:
+    st.session_state.dev_show_metrics = os.getenv("DARK_AI_DEBUG_METRICS", "").lower() in ("1", "true", "yes")
 
 # -------------------- Helpers --------------------
+@st.cache_resource
+def get_shared_chat_store() -> ChatStore:
+    return make_chat_store()
+
+def get_store() -> ChatStore:
+    """
+    Durable stores are shared by every session; the in-memory one is per session.
+    """
+    store = get_shared_chat_store()
+    if isinstance(store, MemoryChatStore):
+        if "chat_store" not in st.session_state:
+            st.session_state.chat_store = MemoryChatStore()
+        store = st.session_state.chat_store
+    return store
+
+@st.cache_resource
+def get_metrics_server():
+    """
+    Prometheus /metrics endpoint on METRICS_PORT (started once per process).
+    """
+    return start_metrics_server()
+
+get_metrics_server()
+
 def set_active(chat_id: str):
     st.session_state.active_chat_id = chat_id
 
 def get_active_chat() -> Optional[ChatSession]:
     cid = st.session_state.active_chat_id
-    return st.session_state.chats.get(cid) if cid else None
-
-def show_thinking_animation(ph):
-    dots = ["Dark Thinking.", "Dark Thinking..", "Dark Thinking..."]
-    for _ in range(3):
-        for d in dots:
-            ph.markdown(f"🌀 **{d}**")
-            sleep(0.2)
-
-# ✅ Old greeting is kept (as requested)
-def generate_funky_greeting():
-    prompt = [
-        {"role": "system", "content": "You are a darkly witty AI greeter. Always return 1–2 short sentences with emojis. Make it mischievous, fun, and slightly chaotic."},
-        {"role": "user", "content": "Give me one funky dark-humor inspired greeting for a new chat."}
-    ]
-    chunks = stream_chat_completion(prompt, temperature=0.9, top_p=1.0, max_tokens=60)
-    out = ""
-    for chunk in chunks:
-        out += chunk[0] if isinstance(chunk, tuple) else chunk
-    return out.strip()
-
-def generate_dark_quote():
-    prompt = [
-        {"role": "system", "content": "You are a witty assistant that produces short dark humor motivational quotes. Each should be one sentence, clever, and end with a cheeky tone, simple english."},
-        {"role": "user", "content": "Give me one dark humor motivational quote, simple english."}
-    ]
-    chunks = stream_chat_completion(prompt, temperature=0.9, top_p=1.0, max_tokens=50)
-    out = ""
-    for chunk in chunks:
-        out += chunk[0] if isinstance(chunk, tuple) else chunk
-    return out.strip()
-
-# ---------- Clarification Gate ----------
-def clarity_check(role_text: str, user_text: str) -> dict:
+    if not cid:
+        return None
+    chat = st.session_state.chats.get(cid)
+    if chat is None:
+        chat = get_store().load_chat(cid)
+        if chat is not None:
+            st.session_state.chats[cid] = chat
+    return chat
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide worker pool for pipeline calls (shared by all sessions). Streamed
+    answers run on their own threads, and stage timeouts don't count queueing.
+    """
+    return ThreadPoolExecutor(max_workers=int(os.getenv("DARK_AI_WORKERS", "8")), thread_name_prefix="dark-ai")
+
+@st.cache_resource
+def get_background_executor() -> ThreadPoolExecutor:
     """
-    Decide if more details are required for a precise, role-aligned answer.
-    Returns: {"need_info": bool, "questions": [str], "reason": str}
+    Separate pool for after-the-reply work, so it never queues ahead of a live turn.
     """
-    sys = {
-        "role": "system",
-        "content": (
-            "You are a planner that *only* decides if more details are required for a precise, role-aligned answer.\n"
-            "Return STRICT JSON with keys: need_info (boolean), questions (array of up to 4 short questions), reason (string).\n"
-            "Ask ONLY for details that materially change the answer. If current info is enough, set need_info=false and questions=[].\n"
-            "NO extra text, NO markdown, JSON only."
-        ),
-    }
-    usr = {
-        "role": "user",
-        "content": (
-            f"ROLE:\n{role_text}\n\n"
-            f"USER_MESSAGE:\n{user_text}\n\n"
-            "Decide if more information is needed to answer accurately within this role."
-        ),
-    }
-    chunks = stream_chat_completion([sys, usr], temperature=0.0, top_p=1.0, max_tokens=180)
-    raw = ""
-    for ch in chunks:
-        raw += ch[0] if isinstance(ch, tuple) else ch
-    raw = raw.strip()
-    try:
-        if raw.startswith("```"):
-            raw = raw.strip("`")
-            if raw.startswith("json"):
-                raw = raw[4:]
-        data = json.loads(raw)
-        need_info = bool(data.get("need_info", False))
-        questions = [str(q).strip() for q in (data.get("questions", []) or []) if str(q).strip()]
-        reason = str(data.get("reason", "")).strip()
-        return {"need_info": need_info, "questions": questions[:4], "reason": reason}
-    except Exception:
-        return {"need_info": False, "questions": [], "reason": ""}
-
-# ---------- Reasoning Mode: hidden planning / executing / judge ----------
-def reason_plan(role_text: str, user_text: str) -> Dict[str, Any]:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="dark-ai-bg")
+
+def schedule_summary(chat: ChatSession):
     """
-    Private planning pass (STRICT JSON). Returns plan dict.
+    Refresh the rolling summary in the background, after the reply is on screen.
     """
-    sys = {
-        "role": "system",
-        "content": (
-            "You are an expert task planner. Produce a compact plan JSON ONLY. "
-            "No explanations, no markdown, strictly valid JSON."
-        ),
-    }
-    usr = {
-        "role": "user",
-        "content": (
-            "Fields required:\n"
-            "{\n"
-            '  "objective": string,\n'
-            '  "assumptions": string[],\n'
-            '  "steps": string[],\n'
-            '  "subproblems": string[],\n'
-            '  "data_to_verify": string[],\n'
-            '  "web_plan": {"should_search": boolean, "queries": string[]},\n'
-            '  "quality_checks": string[]\n'
-            "}\n\n"
-            f"ROLE:\n{role_text}\n\n"
-            f"USER_MESSAGE:\n{user_text}\n\n"
-            "Keep lists short and high-signal (<=5 items each)."
-        ),
-    }
-    chunks = stream_chat_completion([sys, usr], temperature=0.3, top_p=1.0, max_tokens=500)
-    raw = ""
-    for ch in chunks:
-        raw += ch[0] if isinstance(ch, tuple) else ch
-    raw = raw.strip()
-    try:
-        if raw.startswith("```"):
-            raw = raw.strip("`")
-            if raw.startswith("json"):
-                raw = raw[4:]
-        plan = json.loads(raw)
-    except Exception:
-        plan = {
-            "objective": "",
-            "assumptions": [],
-            "steps": [],
-            "subproblems": [],
-            "data_to_verify": [],
-            "web_plan": {"should_search": False, "queries": []},
-            "quality_checks": []
-        }
-    # Sanity defaults
-    plan.setdefault("web_plan", {})
-    plan["web_plan"].setdefault("should_search", False)
-    plan["web_plan"].setdefault("queries", [])
-    return plan
-
-def execute_answer(role_text: str, history_msgs: List[dict], plan: Dict[str, Any], web_sources_block: str, temperature: float, top_p: float) -> str:
+    if chat.memory_mode == "summary":
+        get_background_executor().submit(update_summary, chat)
+
+HISTORY_EAGER = int(os.getenv("CHAT_HISTORY_EAGER", "12"))  # newest messages drawn as chat bubbles
+HISTORY_PAGE = int(os.getenv("CHAT_HISTORY_PAGE", "20"))    # older messages paged in per click
+
+def show_older_messages(chat_id: str):
+    st.session_state.history_older[chat_id] = st.session_state.history_older.get(chat_id, 0) + HISTORY_PAGE
+
+def history_block(role: str, content: str) -> str:
     """
-    Final user-facing answer pass. Streams internally, returns full text.
+    Markdown for one paged-in message.
     """
-    role_guidance = {
-        "role": "system",
-        "content": (
-            f"ROLE (anchor):\n{role_text}\n\n"
-            "Follow the plan below to craft a concise, actionable answer in the role's tone. "
-            "Do NOT reveal the plan or inner steps. Use citations [n] only if WEB CONTEXT is used."
-        ),
-    }
-    plan_msg = {
-        "role": "system",
-        "content": f"PLAN JSON:\n{json.dumps(plan, ensure_ascii=False)}"
-    }
-    msgs = [role_guidance] + history_msgs + [plan_msg]
-
-    if web_sources_block:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msgs.append({
-            "role": "system",
-            "content": (
-                "WEB CONTEXT (use only to support the answer; ignore anything off-role):\n\n"
-                f"Retrieved: {timestamp}\n\nWEB SEARCH RESULTS:\n{web_sources_block}\n\n"
-                "Cite as [n] matching the numbered source."
-            ),
-        })
-
-    chunks = stream_chat_completion(
-        msgs, temperature=temperature, top_p=top_p, max_tokens=None,
-    )
-    draft = ""
-    for ch in chunks:
-        draft += ch[0] if isinstance(ch, tuple) else ch
-    return draft.strip()
+    who = "🧑 **You**" if role == "user" else "🤖 **Assistant**"
+    return f"{who}\n\n{content.strip()}"
 
-def judge_answer(role_text: str, draft: str, used_web: bool) -> Dict[str, Any]:
+def show_stage(ph, label: str):
     """
-    Hidden judge to catch obvious issues. Returns:
-    {"ok": bool, "needs_fix": bool, "issues": [str]}
+    Non-blocking progress line showing which pipeline stage is running.
     """
-    sys = {
-        "role": "system",
-        "content": (
-            "You are a strict answer judge. Return STRICT JSON only. "
-            "Check role alignment, clarity, factuality, presence of citations if web was used, and basic logical coherence."
-        ),
-    }
-    usr = {
-        "role": "user",
-        "content": (
-            f"ROLE:\n{role_text}\n\n"
-            f"USED_WEB: {str(used_web).lower()}\n\n"
-            f"ANSWER:\n{draft}\n\n"
-            'Return JSON: {"ok": boolean, "needs_fix": boolean, "issues": string[]}. Keep issues short.'
-        ),
-    }
-    chunks = stream_chat_completion([sys, usr], temperature=0.0, top_p=1.0, max_tokens=240)
-    raw = ""
-    for ch in chunks:
-        raw += ch[0] if isinstance(ch, tuple) else ch
-    raw = raw.strip()
-    try:
-        if raw.startswith("```"):
-            raw = raw.strip("`")
-            if raw.startswith("json"):
-                raw = raw[4:]
-        data = json.loads(raw)
-        data.setdefault("ok", True)
-        data.setdefault("needs_fix", False)
-        data.setdefault("issues", [])
-        return data
-    except Exception:
-        return {"ok": True, "needs_fix": False, "issues": []}
-
-def revise_answer(role_text: str, draft: str, issues: List[str]) -> str:
+    ph.markdown(f"🌀 **Dark Thinking…** _{label}_")
+
+STAGE_LABELS = {
+    "clarity_check": "checking clarity",
+    "reason_plan": "planning",
+    "plan_with_clarity": "planning",
+    "speculative_search": "searching ahead",
+    "execute_answer": "drafting",
+    "judge_answer": "judging the draft",
+    "revise_answer": "revising",
+}
+
+class StreamlitHooks(PipelineHooks):
     """
-    One-shot revision to fix judge's issues.
+    Renders pipeline progress and streamed text into the assistant bubble.
+    Markdown is redrawn at most every `min_interval` seconds.
     """
-    sys = {
-        "role": "system",
-        "content": (
-            "You are a precise reviser. Produce an improved answer that addresses the listed issues. "
-            "Keep the same intent and role tone. Return ONLY the final answer text (no notes)."
-        ),
-    }
-    usr = {
-        "role": "user",
-        "content": (
-            f"ROLE:\n{role_text}\n\n"
-            f"ISSUES:\n{json.dumps(issues, ensure_ascii=False)}\n\n"
-            f"CURRENT_ANSWER:\n{draft}"
-        ),
-    }
-    chunks = stream_chat_completion([sys, usr], temperature=0.2, top_p=1.0, max_tokens=None)
-    fixed = ""
-    for ch in chunks:
-        fixed += ch[0] if isinstance(ch, tuple) else ch
-    return fixed.strip()
+
+    def __init__(self, placeholder, anim, min_interval: float = 0.08):
+        self.placeholder = placeholder
+        self.anim = anim
+        self.min_interval = min_interval
+        self.last_draw = 0.0
+        self.streaming = False
+
+    def on_stage_start(self, stage, ctx):
+        if stage == "web_search":
+            n = len(ctx.plan["web_plan"].get("queries", [])[:ctx.max_queries])
+            show_stage(self.anim, f"searching {n} quer{'y' if n == 1 else 'ies'}")
+        else:
+            show_stage(self.anim, STAGE_LABELS.get(stage, stage))
+        self.streaming = False
+
+    def on_delta(self, stage, text):
+        if not self.streaming:
+            self.anim.empty()  # first token: the answer itself is the progress now
+            self.streaming = True
+        now = monotonic()
+        if now - self.last_draw >= self.min_interval:
+            self.placeholder.markdown(text + "▌")
+            self.last_draw = now
+
+    def on_stage_end(self, stage, ctx, elapsed):
+        if stage in ("execute_answer", "revise_answer"):
+            self.placeholder.markdown(ctx.final_text)
+        elif stage == "web_search":
+            for err in ctx.search_errors:
+                st.warning(f"Web search failed: {err}")
+            if ctx.results:
+                with st.expander(f"🔗 Web sources used ({len(ctx.results)})", expanded=False):
+                    for i, r in enumerate(ctx.results, start=1):
+                        st.markdown(f"**[{i}] [{r.title}]({r.url})**")
+                        if r.snippet:
+                            st.caption(r.snippet)
+                        if r.extract:
+                            st.markdown(f"> {r.extract}")
+
+    def on_error(self, stage, ctx, exc):
+        st.warning(f"Stage `{stage}` failed: {exc}")
+
+# Served while the pools are still warming up (or if the LLM is unreachable)
+STATIC_GREETINGS = [
+    "Welcome back to the void 🕳️ — I saved you a seat next to your unfinished plans. 😈",
+    "Ah, a new chat 🌑. Let's make questionable decisions together. 🔥",
+    "Greetings, mortal 👻. Your curiosity has been noted… and judged. 😏",
+    "Hello there 🦇! I promise to be helpful. Mostly. Probably. 🎲",
+]
+STATIC_QUOTES = [
+    "Dream big — disappointment scales better that way. 😈",
+    "Every expert was once a beginner who refused to quit, mostly out of spite.",
+    "Hard work pays off eventually; laziness pays off right now, but the interest is brutal.",
+    "Keep going — the void is patient, but your deadline isn't.",
+    "Believe in yourself, because the compiler certainly doesn't.",
+]
+
+@st.cache_resource
+def get_quote_pool() -> FlairPool:
+    pool = FlairPool(generate_dark_quote, STATIC_QUOTES)
+    pool.refill()
+    return pool
+
+@st.cache_resource
+def get_greeting_pool() -> FlairPool:
+    pool = FlairPool(generate_funky_greeting, STATIC_GREETINGS)
+    pool.refill()
+    return pool
 
 # -------------------- Get browser local time (only once) --------------------
 if st.session_state.browser_time is None or st.session_state.browser_hour is None:
@@ -311,69 +250,94 @@ if st.session_state.browser_time is None or st.session_state.browser_hour is Non
         js_expressions="new Date().toLocaleTimeString([], {hour: '2-digit', minute:'2-digit', second:'2-digit', hour12:true})"
     )
     user_hour = streamlit_js_eval(js_expressions="new Date().getHours()")
+    user_tz_offset = streamlit_js_eval(js_expressions="new Date().getTimezoneOffset()")
 
     if user_time:
         st.session_state.browser_time = user_time
     if user_hour is not None:
         st.session_state.browser_hour = int(user_hour)
+    if user_tz_offset is not None:
+        st.session_state.browser_tz_offset = int(user_tz_offset)
 
 # -------------------- Sidebar --------------------
-with st.sidebar:
-    st.title("🌌 Dark AI Assistant")
-    st.caption("Your gateway to intelligent conversations.")
-
-    # Start New Chat Button
-    st.button("➕ Start New Chat", on_click=lambda: st.session_state.update({"creating_chat": True, "role_draft": ""}))
-
+# The page is split into st.fragment blocks: a widget inside one reruns only
+# that block. Anything that changes what the main area shows (switching,
+# creating or deleting a chat) asks for a full st.rerun().
+@st.fragment
+def sidebar_chats():
     # Display existing chats
-    if st.session_state.chats:
-        st.markdown("### 🗂️ Chats")
-        ids = list(st.session_state.chats.keys())
-
-        if st.session_state.active_chat_id not in ids:
-            st.session_state.active_chat_id = ids[0]
-
-        selected = st.selectbox(
-            label="Select a conversation",
-            options=ids,
-            index=ids.index(st.session_state.active_chat_id),
-            format_func=lambda x: st.session_state.chats[x].title,
-        )
-
-        if selected and selected != st.session_state.active_chat_id:
-            set_active(selected)
-
-        act = get_active_chat()
-        if act:
-            with st.expander("⚙️ Manage Chat", expanded=False):
-                new_title = st.text_input("Rename Chat", value=act.title, key=f"rename_{act.id}")
-                c1, c2 = st.columns(2)
-                with c1:
-                    if st.button("💾 Save"):
-                        act.title = new_title[:60]
-                        st.rerun()
-                with c2:
-                    if st.button("🗑️ Delete"):
-                        del st.session_state.chats[act.id]
-                        st.session_state.active_chat_id = None
-                        st.rerun()
-    else:
+    chat_titles = dict(get_store().list_chats())  # titles only; bodies load on selection
+    if not chat_titles:
         st.info("No chats yet. Click **Start New Chat** to begin.")
+        return
+    st.markdown("### 🗂️ Chats")
+    ids = list(chat_titles.keys())
+
+    if st.session_state.active_chat_id not in ids:
+        st.session_state.active_chat_id = ids[0]
+
+    selected = st.selectbox(
+        label="Select a conversation",
+        options=ids,
+        index=ids.index(st.session_state.active_chat_id),
+        format_func=lambda x: chat_titles[x],
+    )
 
-    st.divider()
-
+    if selected and selected != st.session_state.active_chat_id:
+        set_active(selected)
+        st.rerun()  # main area shows another chat
+
+    act = get_active_chat()
+    if act:
+        with st.expander("⚙️ Manage Chat", expanded=False):
+            new_title = st.text_input("Rename Chat", value=act.title, key=f"rename_{act.id}")
+            c1, c2 = st.columns(2)
+            with c1:
+                if st.button("💾 Save"):
+                    act.title = new_title[:60]
+                    get_store().save_chat(act)
+                    st.rerun(scope="fragment")  # only the chat list shows titles
+            with c2:
+                if st.button("🗑️ Delete"):
+                    get_store().delete_chat(act.id)
+                    st.session_state.chats.pop(act.id, None)
+                    st.session_state.active_chat_id = None
+                    st.rerun()
+
+@st.fragment
+def sidebar_flair():
     # Auto-greet checkbox
     st.checkbox("Auto-greet after role is set", value=st.session_state.auto_greet, key="auto_greet")
 
     if not st.session_state.dark_quote:
-        st.session_state.dark_quote = generate_dark_quote()
+        st.session_state.dark_quote = get_quote_pool().take()
 
     st.markdown("### 🔥 Chaos Fuel")
     st.caption(st.session_state.dark_quote)
 
+with st.sidebar:
+    st.title("🌌 Dark AI Assistant")
+    st.caption("Your gateway to intelligent conversations.")
+
+    # Start New Chat Button (outside the fragments: it changes the main area)
+    st.button("➕ Start New Chat", on_click=lambda: st.session_state.update({"creating_chat": True, "role_draft": ""}))
+
+    sidebar_chats()
+    st.divider()
+    sidebar_flair()
+
 # -------------------- Main --------------------
-active_chat = get_active_chat()
-render_navbar(active_chat, st.session_state.browser_time, st.session_state.browser_hour)
+NAVBAR_REFRESH = float(os.getenv("NAVBAR_REFRESH_SECONDS", "30"))  # clock tick; 0 = static
+
+@st.fragment(run_every=NAVBAR_REFRESH or None)
+def navbar():
+    render_navbar(
+        get_active_chat(), st.session_state.browser_time, st.session_state.browser_hour,
+        st.session_state.browser_tz_offset,
+    )
+
+inject_navbar_styles()
+navbar()
 
 st.title("💬 Dark AI Assistant")
 st.caption("Your personalized AI-powered assistant.")
@@ -410,15 +374,20 @@ if st.session_state.creating_chat:
             chat.use_web_search = True
             chat.web_results_per_query = 5
             chat.web_extract_chars = 900
-            chat.reasoning_depth = "Standard"  # Fast | Standard | Deep
+            chat.web_fetch_pages = False  # read result pages instead of snippets
+            chat.reasoning_depth = "Standard"  # Fast | Standard | Deep | Auto
+            chat.speculative_plan = True  # run planner alongside the clarity check
+            chat.planner_mode = "split"  # split | merged (one plan + clarity call)
+            chat.speculative_search = False  # search the raw message while planning
 
             st.session_state.chats[chat.id] = chat
             st.session_state.active_chat_id = chat.id
             st.session_state.creating_chat = False
             # keep the original funky greeter
             if st.session_state.auto_greet:
-                greeting = generate_funky_greeting()
+                greeting = get_greeting_pool().take()
                 chat.messages.append({"role": "assistant", "content": greeting})
+            get_store().sync(chat)
             st.rerun()
 
     if st.button("❌ Cancel"):
@@ -438,295 +407,241 @@ st.markdown("> Everything is answered **through this role**. If I need details,
 st.divider()
 
 # ---- Compact Settings UI ----
-st.markdown('<div class="compact">', unsafe_allow_html=True)
-
-with st.expander("⚙️ Chat Settings", expanded=False):
-    # Row 1: Reasoning + Model controls (compact)
-    r1c1, r1c2, r1c3 = st.columns([1, 1, 1])
-    with r1c1:
-        active.reasoning_depth = st.selectbox(
-            "Reasoning depth",
-            options=["Fast", "Standard", "Deep"],
-            index=["Fast", "Standard", "Deep"].index(getattr(active, "reasoning_depth", "Standard")),
-            key=f"reasoning_depth_{active.id}",
-        )
-    with r1c2:
-        active.temperature = st.slider("Temperature", 0.0, 1.0, value=active.temperature, key=f"temperature_{active.id}")
-    with r1c3:
-        active.top_p = st.slider("Top-p", 0.0, 1.0, value=active.top_p, key=f"top_p_{active.id}")
-
-    # Row 2: Web search controls (compact)
-    r2c1, r2c2, r2c3 = st.columns([1, 1, 1])
-    with r2c1:
-        active.use_web_search = st.checkbox(
-            "Enable web search",
-            value=getattr(active, "use_web_search", True),
-            key=f"use_web_search_{active.id}"
-        )
-    with r2c2:
+@st.fragment
+def chat_settings(active: ChatSession):
+    # A slider move here reruns only this block; the turn reads the new
+    # values from `active` when the next message is sent.
+    st.markdown('<div class="compact">', unsafe_allow_html=True)
+
+    with st.expander("⚙️ Chat Settings", expanded=False):
+        # Row 1: Reasoning + Model controls (compact)
+        r1c1, r1c2, r1c3 = st.columns([1, 1, 1])
+        with r1c1:
+            active.reasoning_depth = st.selectbox(
+                "Reasoning depth",
+                options=["Auto", "Fast", "Standard", "Deep"],
+                index=["Auto", "Fast", "Standard", "Deep"].index(getattr(active, "reasoning_depth", "Standard")),
+                help="Auto picks Fast/Standard/Deep per message (small talk skips planning and judging).",
+                key=f"reasoning_depth_{active.id}",
+            )
+        with r1c2:
+            active.temperature = st.slider("Temperature", 0.0, 1.0, value=active.temperature, key=f"temperature_{active.id}")
+        with r1c3:
+            active.top_p = st.slider("Top-p", 0.0, 1.0, value=active.top_p, key=f"top_p_{active.id}")
+
+        # Row 2: Web search controls (compact)
+        r2c1, r2c2, r2c3 = st.columns([1, 1, 1])
+        with r2c1:
+            active.use_web_search = st.checkbox(
+                "Enable web search",
+                value=getattr(active, "use_web_search", True),
+                key=f"use_web_search_{active.id}"
+            )
+        with r2c2:
+            if active.use_web_search:
+                active.web_results_per_query = st.slider(
+                    "Results per query", 1, 10,
+                    value=getattr(active, "web_results_per_query", 5),
+                    key=f"web_results_per_query_{active.id}"
+                )
+        with r2c3:
+            if active.use_web_search:
+                active.web_extract_chars = st.slider(
+                    "Chars per source", 300, 2000,
+                    step=50,
+                    value=getattr(active, "web_extract_chars", 900),
+                    key=f"web_extract_chars_{active.id}"
+                )
+
+        # Row 3: Latency controls
         if active.use_web_search:
-            active.web_results_per_query = st.slider(
-                "Results per query", 1, 10,
-                value=getattr(active, "web_results_per_query", 5),
-                key=f"web_results_per_query_{active.id}"
+            active.web_fetch_pages = st.checkbox(
+                "Read full result pages (slower, better sources)",
+                value=getattr(active, "web_fetch_pages", False),
+                key=f"web_fetch_pages_{active.id}"
             )
-    with r2c3:
+        active.memory_mode = st.selectbox(
+            "Memory",
+            options=["window", "summary"],
+            index=["window", "summary"].index(active.memory_mode),
+            format_func=lambda x: "Recent messages" if x == "window" else "Summary + recent messages",
+            key=f"memory_mode_{active.id}",
+        )
+        active.speculative_plan = st.checkbox(
+            "Plan while checking clarity (faster, may waste a planner call)",
+            value=getattr(active, "speculative_plan", True),
+            key=f"speculative_plan_{active.id}"
+        )
+        active.planner_mode = st.selectbox(
+            "Planner",
+            options=["split", "merged"],
+            index=["split", "merged"].index(getattr(active, "planner_mode", "split")),
+            format_func=lambda x: "Clarity check + plan (2 calls)" if x == "split" else "Combined plan + clarity (1 call)",
+            key=f"planner_mode_{active.id}",
+        )
         if active.use_web_search:
-            active.web_extract_chars = st.slider(
-                "Chars per source", 300, 2000,
-                step=50,
-                value=getattr(active, "web_extract_chars", 900),
-                key=f"web_extract_chars_{active.id}"
+            active.speculative_search = st.checkbox(
+                "Search while planning (faster, may waste a search)",
+                value=getattr(active, "speculative_search", False),
+                key=f"speculative_search_{active.id}"
             )
 
-st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+    get_store().save_chat(active)  # no-op unless a setting changed
+
+chat_settings(active)
 
 st.divider()
 
-# ---- Conversation ----
-st.markdown("### 📝 Conversation")
+# ---- Conversation + Chat Input ----
+@st.fragment
+def conversation(active: ChatSession):
+    # Sending a message or paging in history reruns only this block.
+    st.markdown("### 📝 Conversation")
+
+    st.markdown('<div id="chat-top-anchor"></div>', unsafe_allow_html=True)
+
+    # Only the newest HISTORY_EAGER messages are drawn as chat bubbles; older
+    # ones are paged in on request as one Markdown element per page.
+    visible = [i for i, m in enumerate(active.messages) if m["role"] in ("user", "assistant")]
+    older_shown = st.session_state.history_older.get(active.id, 0)
+    eager = visible[-HISTORY_EAGER:]
+    paged = visible[:len(visible) - len(eager)]
+    hidden = max(0, len(paged) - older_shown)
+    if hidden:
+        st.button(
+            f"⬆️ Show {min(HISTORY_PAGE, hidden)} older messages ({hidden} hidden)",
+            key=f"history_older_{active.id}",
+            on_click=show_older_messages,
+            args=(active.id,),
+        )
+    for start in range(hidden, len(paged), HISTORY_PAGE):
+        page = paged[start:start + HISTORY_PAGE]
+        st.markdown("\n\n---\n\n".join(
+            history_block(active.messages[i]["role"], active.messages[i]["content"])
+            for i in page
+        ))
+    if len(paged) > hidden:
+        st.divider()
+
+    for idx in eager:
+        m = active.messages[idx]
+        if m["role"] == "user":
+            with st.chat_message("user"):
+                st.markdown(m["content"])
+        else:
+            with st.chat_message("assistant"):
+                st.markdown(m["content"])
+                st.download_button(
+                    label="⬇️ Download as Markdown",
+                    data=m["content"],
+                    file_name=f"assistant_reply_{idx}.md",
+                    mime="text/markdown",
+                    key=f"download_{idx}"
+                )
+
+    st.markdown('<div id="chat-bottom-anchor"></div>', unsafe_allow_html=True)
 
-st.markdown('<div id="chat-top-anchor"></div>', unsafe_allow_html=True)
+    st.divider()
 
-for idx, m in enumerate(active.messages):
-    if m["role"] == "user":
+    # ---- Chat Input ----
+    st.markdown("### 💬 Type Your Message")
+    user_text = st.chat_input("Type your message…")
+
+    if user_text:
+        raw_user_text = user_text
+        lowered = raw_user_text.strip().lower()
+        if lowered.startswith(("offline:", "no web:", "noweb:")):
+            do_web = False
+            for prefix in ("offline:", "no web:", "noweb:"):
+                if lowered.startswith(prefix):
+                    user_text = raw_user_text[len(prefix):].strip()
+                    break
+        else:
+            do_web = getattr(active, "use_web_search", True)
+        # "fresh:" keeps web search on but skips the search cache
+        use_search_cache = True
+        if user_text.strip().lower().startswith("fresh:"):
+            user_text = user_text.strip()[len("fresh:"):].strip()
+            use_search_cache = False
+
+        # Append user's message to history
+        active.messages.append({"role": "user", "content": user_text})
         with st.chat_message("user"):
-            st.markdown(m["content"])
-    elif m["role"] == "assistant":
-        with st.chat_message("assistant"):
-            st.markdown(m["content"])
-            st.download_button(
-                label="⬇️ Download as Markdown",
-                data=m["content"],
-                file_name=f"assistant_reply_{idx}.md",
-                mime="text/markdown",
-                key=f"download_{idx}"
-            )
+            st.markdown(user_text)
 
-st.markdown('<div id="chat-bottom-anchor"></div>', unsafe_allow_html=True)
-
-st.divider()
+        # Clarification state for this chat
+        chat_clar = st.session_state.clarify_state.get(active.id, {"awaiting": False, "questions": []})
 
-# ---- Chat Input ----
-st.markdown("### 💬 Type Your Message")
-user_text = st.chat_input("Type your message…")
-
-if user_text:
-    raw_user_text = user_text
-    lowered = raw_user_text.strip().lower()
-    if lowered.startswith(("offline:", "no web:", "noweb:")):
-        do_web = False
-        for prefix in ("offline:", "no web:", "noweb:"):
-            if lowered.startswith(prefix):
-                user_text = raw_user_text[len(prefix):].strip()
-                break
-    else:
-        do_web = getattr(active, "use_web_search", True)
-
-    # Append user's message to history
-    active.messages.append({"role": "user", "content": user_text})
-    with st.chat_message("user"):
-        st.markdown(user_text)
-
-    # Clarification state for this chat
-    chat_clar = st.session_state.clarify_state.get(active.id, {"awaiting": False, "questions": []})
-
-    with st.chat_message("assistant"):
-        placeholder = st.empty()
-        anim = st.empty()
-        show_thinking_animation(anim)
-
-        # -------------------- If awaiting clarifications: proceed directly with reasoning pipeline --------------------
-        awaiting = chat_clar.get("awaiting", False)
-        if awaiting:
-            st.session_state.clarify_state[active.id] = {"awaiting": False, "questions": []}
-            # Build history for model (role-anchored)
-            role_guidance = {
-                "role": "system",
-                "content": (
-                    f"ROLE (anchor):\n{active.role}\n\n"
-                    "Always interpret the request through this ROLE’s lens. "
-                    "Use the latest user clarifications to proceed."
-                ),
-            }
-            history_for_model = [role_guidance] + active.messages_for_model(max_pairs=40)
-
-            # Reasoning depth flow
-            reasoning_depth = getattr(active, "reasoning_depth", "Standard")
-            web_sources_block = ""
-            used_web = False
-
-            # PLAN (Standard/Deep)
-            if reasoning_depth in ("Standard", "Deep"):
-                plan = reason_plan(active.role, user_text)
-            else:
-                plan = {
-                    "objective": "",
-                    "assumptions": [],
-                    "steps": [],
-                    "subproblems": [],
-                    "data_to_verify": [],
-                    "web_plan": {"should_search": False, "queries": []},
-                    "quality_checks": []
-                }
-
-            # Optional targeted web search (if enabled AND plan suggests)
-            if do_web and plan.get("web_plan", {}).get("should_search") and active.use_web_search:
-                all_results = []
-                for q in plan["web_plan"].get("queries", [])[:3]:
-                    try:
-                        all_results.extend(
-                            web_search(q, max_results=active.web_results_per_query, extract_chars=active.web_extract_chars)
-                        )
-                    except Exception as e:
-                        st.warning(f"Web search failed: {e}")
-                if all_results:
-                    with st.expander(f"🔗 Web sources used ({len(all_results)})", expanded=False):
-                        for i, r in enumerate(all_results, start=1):
-                            st.markdown(f"**[{i}] [{r.title}]({r.url})**")
-                            if r.snippet:
-                                st.caption(r.snippet)
-                            if r.extract:
-                                st.markdown(f"> {r.extract}")
-                    web_sources_block = format_results_for_prompt(all_results)
-                    used_web = True
-
-            # EXECUTE answer
-            draft = execute_answer(
-                role_text=active.role,
-                history_msgs=history_for_model,
-                plan=plan,
-                web_sources_block=web_sources_block,
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            anim = st.empty()
+            show_stage(anim, "warming up")
+
+            after_clarification = chat_clar.get("awaiting", False)
+            if after_clarification:
+                st.session_state.clarify_state[active.id] = {"awaiting": False, "questions": []}
+
+            ctx = TurnContext(
+                role=active.role,
+                user_text=user_text,
+                history=anchored_history(active.role, active.messages_for_model(max_pairs=40), after_clarification),
+                depth=active.reasoning_depth,
+                after_clarification=after_clarification,
+                do_web=do_web and active.use_web_search,
+                use_search_cache=use_search_cache,
+                web_results_per_query=active.web_results_per_query,
+                web_extract_chars=active.web_extract_chars,
+                web_fetch_pages=active.web_fetch_pages,
+                search_deadline=float(os.getenv("WEB_SEARCH_DEADLINE", "12")),
+                speculative_plan=active.speculative_plan,
+                planner_mode=active.planner_mode,
+                speculative_search=active.speculative_search,
                 temperature=active.temperature,
-                top_p=active.top_p
-            )
-
-            final_text = draft
-            # DEEP: judge + one-shot revise
-            if getattr(active, "reasoning_depth", "Standard") == "Deep":
-                judge = judge_answer(active.role, draft, used_web=used_web)
-                if judge.get("needs_fix") and judge.get("issues"):
-                    final_text = revise_answer(active.role, draft, judge["issues"])
-
-            placeholder.markdown(final_text)
-            active.messages.append({"role": "assistant", "content": final_text})
-            st.download_button(
-                label="⬇️ Download as Markdown",
-                data=final_text,
-                file_name=f"assistant_reply_{len(active.messages)}.md",
-                mime="text/markdown",
-                key=f"download_{len(active.messages)}"
+                top_p=active.top_p,
             )
+            run_turn(ctx, hooks=StreamlitHooks(placeholder, anim), executor=get_executor())
             anim.empty()
-            st.stop()
-
-        # -------------------- Otherwise, run the Clarification Gate first --------------------
-        check = clarity_check(active.role, user_text)
-        if check.get("need_info") and check.get("questions"):
-            q_list = check["questions"]
-            asked_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            st.session_state.clarify_state[active.id] = {"awaiting": True, "questions": q_list, "asked_at": asked_at}
-
-            bullet_qs = "\n".join([f"1) {q_list[0]}"] + [f"{i+1}) {q}" for i, q in enumerate(q_list[1:])]) if q_list else ""
-            clarify_msg = (
-                "To give you the most accurate, role-aligned answer, I need a few details:\n\n"
-                f"{bullet_qs}\n\n"
-                "_Reply with the answers (you can be brief)._"
-            )
-            placeholder.markdown(clarify_msg)
-            active.messages.append({"role": "assistant", "content": clarify_msg})
+            if ctx.depth_reason:
+                st.caption(f"🧭 Auto depth: {ctx.depth} — {ctx.depth_reason}")
+
+            if ctx.clarification:
+                # -------------------- Clarification Gate asked for details --------------------
+                q_list = ctx.clarification["questions"]
+                asked_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                st.session_state.clarify_state[active.id] = {"awaiting": True, "questions": q_list, "asked_at": asked_at}
+
+                bullet_qs = "\n".join([f"1) {q_list[0]}"] + [f"{i+1}) {q}" for i, q in enumerate(q_list[1:])]) if q_list else ""
+                reply = (
+                    "To give you the most accurate, role-aligned answer, I need a few details:\n\n"
+                    f"{bullet_qs}\n\n"
+                    "_Reply with the answers (you can be brief)._"
+                )
+                placeholder.markdown(reply)
+            else:
+                reply = ctx.final_text
+                # (Optional) Developer debug: show plan JSON
+                if st.session_state.dev_show_plan:
+                    with st.expander("🧠 Plan (debug)", expanded=False):
+                        st.code(json.dumps(ctx.plan, indent=2, ensure_ascii=False), language="json")
+            # (Optional) Developer debug: per-stage latency/tokens
+            if st.session_state.dev_show_metrics:
+                with st.expander("⏱️ Turn metrics (debug)", expanded=False):
+                    st.table(ctx.metrics.rows())
+                    st.caption(" · ".join(f"{k}: {v}" for k, v in ctx.metrics.totals().items()))
+                    st.caption("Deployments")
+                    st.table(get_router().snapshot())
+
+            active.messages.append({"role": "assistant", "content": reply})
             st.download_button(
                 label="⬇️ Download as Markdown",
-                data=clarify_msg,
+                data=reply,
                 file_name=f"assistant_reply_{len(active.messages)}.md",
                 mime="text/markdown",
                 key=f"download_{len(active.messages)}"
             )
-            anim.empty()
-            st.stop()
-
-        # -------------------- If no clarification needed: Reasoning pipeline --------------------
-        # Build history for model (role-anchored)
-        role_guidance = {
-            "role": "system",
-            "content": (
-                f"ROLE (anchor):\n{active.role}\n\n"
-                "Always interpret the user's request through this ROLE’s lens. "
-                "If critical details are missing, ask up to 3 concise questions before answering; "
-                "otherwise proceed."
-            ),
-        }
-        history_for_model = [role_guidance] + active.messages_for_model(max_pairs=40)
-
-        # Reasoning depth flow
-        reasoning_depth = getattr(active, "reasoning_depth", "Standard")
-        web_sources_block = ""
-        used_web = False
-
-        # PLAN (Standard/Deep)
-        if reasoning_depth in ("Standard", "Deep"):
-            plan = reason_plan(active.role, user_text)
-        else:
-            plan = {
-                "objective": "",
-                "assumptions": [],
-                "steps": [],
-                "subproblems": [],
-                "data_to_verify": [],
-                "web_plan": {"should_search": False, "queries": []},
-                "quality_checks": []
-            }
-
-        # Optional targeted web search (if enabled AND plan suggests)
-        if do_web and plan.get("web_plan", {}).get("should_search") and active.use_web_search:
-            all_results = []
-            for q in plan["web_plan"].get("queries", [])[:3]:
-                try:
-                    all_results.extend(
-                        web_search(q, max_results=active.web_results_per_query, extract_chars=active.web_extract_chars)
-                    )
-                except Exception as e:
-                    st.warning(f"Web search failed: {e}")
-            if all_results:
-                with st.expander(f"🔗 Web sources used ({len(all_results)})", expanded=False):
-                    for i, r in enumerate(all_results, start=1):
-                        st.markdown(f"**[{i}] [{r.title}]({r.url})**")
-                        if r.snippet:
-                            st.caption(r.snippet)
-                        if r.extract:
-                            st.markdown(f"> {r.extract}")
-                web_sources_block = format_results_for_prompt(all_results)
-                used_web = True
-
-        # EXECUTE answer
-        draft = execute_answer(
-            role_text=active.role,
-            history_msgs=history_for_model,
-            plan=plan,
-            web_sources_block=web_sources_block,
-            temperature=active.temperature,
-            top_p=active.top_p
-        )
+            get_store().sync(active)
+            if not ctx.clarification:
+                schedule_summary(active)
 
-        final_text = draft
-        # DEEP: judge + one-shot revise
-        if reasoning_depth == "Deep":
-            judge = judge_answer(active.role, draft, used_web=used_web)
-            if judge.get("needs_fix") and judge.get("issues"):
-                final_text = revise_answer(active.role, draft, judge["issues"])
-
-        # (Optional) Developer debug: show plan JSON
-        if st.session_state.dev_show_plan:
-            with st.expander("🧠 Plan (debug)", expanded=False):
-                st.code(json.dumps(plan, indent=2, ensure_ascii=False), language="json")
-
-        placeholder.markdown(final_text)
-        active.messages.append({"role": "assistant", "content": final_text})
-        st.download_button(
-            label="⬇️ Download as Markdown",
-            data=final_text,
-            file_name=f"assistant_reply_{len(active.messages)}.md",
-            mime="text/markdown",
-            key=f"download_{len(active.messages)}"
-        )
-        anim.empty()
+conversation(active)
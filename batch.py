@@ -0,0 +1,189 @@
+# batch.py
+"""
+Run many role + question pairs through the Dark AI pipeline from the command line.
+
+Input is JSONL, one job per line:
+
+    {"id": "q1", "role": "You are a Python tutor.", "question": "What is a generator?",
+     "depth": "Standard", "web": false}
+
+Only "role" and "question" are required. "id" defaults to the line number;
+"depth" (Fast | Standard | Deep | Auto) and "web" fall back to the CLI flags.
+Results are appended to the output JSONL as each job finishes. Jobs whose id
+already has a row in the output are skipped (failed ones too, unless
+--retry-errors), so an interrupted run picks up where it stopped.
+
+    python batch.py prompts.jsonl -o results.jsonl --concurrency 8 --depth Standard
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Set
+
+from utils.metrics import TurnMetrics, percentile
+from utils.pipeline import ALL_DEPTHS, TurnContext, run_turn
+from utils.reasoning import anchored_history
+
+
+def read_jobs(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{path}:{n}: invalid JSON ({e})")
+            job.setdefault("id", str(n))
+            job["id"] = str(job["id"])
+            yield job
+
+
+def finished_ids(path: str, retry_errors: bool) -> Set[str]:
+    """
+    Ids already in the output; failed rows count only without --retry-errors.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by the interruption
+            if not (retry_errors and row.get("error")):
+                done.add(str(row.get("id")))
+    return done
+
+
+DEPTHS = ALL_DEPTHS + ("Auto",)
+
+
+def _job_error(job: Dict) -> str:
+    if not job.get("role") or not job.get("question"):
+        return "job needs \"role\" and \"question\""
+    if job.get("depth") and job["depth"] not in DEPTHS:
+        return f"unknown depth {job['depth']!r}; expected one of {', '.join(DEPTHS)}"
+    return ""
+
+
+# Pipeline pool threads per concurrent job (clarity + plan, speculative + planned search)
+TURN_WORKERS_PER_JOB = 4
+
+
+def run_job(job: Dict, args, executor: Executor) -> Dict:
+    error = _job_error(job)
+    if error:
+        return {"id": job["id"], "error": error, "latency_s": 0.0, "tokens": TurnMetrics().totals()}
+    role, question = job["role"], job["question"]
+    history = anchored_history(role, [{"role": "system", "content": role}, {"role": "user", "content": question}],
+                               allow_questions=args.allow_clarify)
+    ctx = TurnContext(
+        role=role,
+        user_text=question,
+        history=history,
+        depth=job.get("depth") or args.depth,
+        # nobody is there to answer clarifying questions unless asked for
+        skip_clarification=not args.allow_clarify,
+        do_web=job.get("web", not args.no_web),
+        web_fetch_pages=args.fetch_pages,
+        planner_mode=args.planner,
+        speculative_search=args.speculative_search,
+        temperature=job.get("temperature", args.temperature),
+    )
+    started = time.monotonic()
+    row = {"id": job["id"]}
+    try:
+        run_turn(ctx, executor=executor)
+        if not ctx.clarification and not ctx.final_text.strip():
+            raise RuntimeError("the pipeline produced no reply")
+        row.update({
+            "reply": ctx.final_text,
+            "clarification": ctx.clarification["questions"] if ctx.clarification else None,
+            "depth": ctx.depth,
+            "sources": [r.url for r in ctx.results],
+        })
+    except Exception as e:
+        row["error"] = str(e) or type(e).__name__
+    row["latency_s"] = round(time.monotonic() - started, 3)
+    row["tokens"] = ctx.metrics.totals()
+    return row
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input", help="JSONL with role/question per line")
+    ap.add_argument("-o", "--output", required=True, help="JSONL results (appended; used for resume)")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--depth", default="Standard", choices=DEPTHS)
+    ap.add_argument("--planner", default="split", choices=["split", "merged"])
+    ap.add_argument("--speculative-search", action="store_true", help="search each question while planning")
+    ap.add_argument("--temperature", type=float, default=0.7)
+    ap.add_argument("--no-web", action="store_true", help="disable web search unless a job sets \"web\"")
+    ap.add_argument("--fetch-pages", action="store_true", help="read full result pages")
+    ap.add_argument("--allow-clarify", action="store_true",
+                    help="keep the clarification gate (its questions are recorded instead of an answer)")
+    ap.add_argument("--retry-errors", action="store_true", help="re-run jobs whose previous row has an error")
+    ap.add_argument("--limit", type=int, default=0, help="stop after this many jobs (0 = all)")
+    args = ap.parse_args(argv)
+
+    done = finished_ids(args.output, args.retry_errors)
+    jobs: List[Dict] = [j for j in read_jobs(args.input) if j["id"] not in done]
+    if args.limit:
+        jobs = jobs[:args.limit]
+    print(f"{len(done)} already done, {len(jobs)} to run", file=sys.stderr)
+
+    lock = threading.Lock()
+    rows: List[Dict] = []
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="batch")
+    # sized to this run rather than sharing the pipeline's process-wide default
+    turn_pool = ThreadPoolExecutor(max_workers=max(1, args.concurrency) * TURN_WORKERS_PER_JOB,
+                                   thread_name_prefix="batch-turn")
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            futures = [pool.submit(run_job, job, args, turn_pool) for job in jobs]
+            for fut in as_completed(futures):
+                row = fut.result()
+                with lock:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush()
+                    rows.append(row)
+                status = "error: " + row["error"] if row.get("error") else f"{row['latency_s']:.1f}s"
+                print(f"[{len(rows)}/{len(jobs)}] {row['id']} {status}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("interrupted; waiting for in-flight jobs to finish (queued ones are cancelled). Finished rows are "
+              "saved; rerun the same command to resume", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        turn_pool.shutdown(wait=False)
+        return 130
+    pool.shutdown()
+    turn_pool.shutdown()
+
+    wall = time.monotonic() - started
+    ok = [r for r in rows if not r.get("error")]
+    lat = [r["latency_s"] for r in ok]
+    report = {
+        "jobs": len(rows),
+        "errors": len(rows) - len(ok),
+        "wall_s": round(wall, 2),
+        "jobs_per_min": round(len(ok) / wall * 60, 2) if wall else 0.0,
+        "p50_s": percentile(lat, 50),
+        "p95_s": percentile(lat, 95),
+        "prompt_tokens": sum(r["tokens"]["prompt_tokens"] for r in rows),
+        "completion_tokens": sum(r["tokens"]["completion_tokens"] for r in rows),
+        "llm_calls": sum(r["tokens"]["llm_calls"] for r in rows),
+        "cache_hits": sum(r["tokens"]["cache_hits"] for r in rows),
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# bench/fake_search.py
+"""
+Local stand-in for the Startpage HTML that utils.web_search scrapes, plus
+simple article pages for the page-extraction stage.
+
+    GET /sp/search?q=...   result list (a.result-link / .w-gl__description)
+    GET /page/<n>?q=...    article page with boilerplate around a few paragraphs
+"""
+import html
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_handler(latency: float = 0.15, results: int = 8):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _html(self, body: str):
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = html.escape(parse_qs(url.query).get("q", [""])[0])
+            time.sleep(latency)
+            base = f"http://{self.headers.get('Host')}"
+            if url.path.startswith("/sp/search"):
+                items = "".join(
+                    f'<div class="w-gl__result"><a class="result-link" href="{base}/page/{i}?q={query}">'
+                    f"Result {i} for {query}</a>"
+                    f'<p class="w-gl__description">Snippet {i}: a short summary about {query}.</p></div>'
+                    for i in range(1, results + 1)
+                )
+                self._html(f"<html><body><div class='w-gl'>{items}</div></body></html>")
+            elif url.path.startswith("/page/"):
+                paras = "".join(
+                    f"<p>Paragraph {j} discussing {query} in enough detail to pass the extractor's minimum length.</p>"
+                    for j in range(1, 6)
+                )
+                self._html(
+                    "<html><head><script>var x = 1;</script></head><body>"
+                    "<nav>Home | About | Contact</nav>"
+                    f"<article><h1>{query}</h1>{paras}</article>"
+                    "<footer>Copyright nobody</footer></body></html>"
+                )
+            else:
+                self.send_error(404)
+
+    return Handler
+
+
+def start_fake_search(host: str = "127.0.0.1", port: int = 0, latency: float = 0.15, results: int = 8) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(latency, results))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-search", daemon=True).start()
+    return server
@@ -0,0 +1,178 @@
+# bench/load_api.py
+"""
+Load test for api/server.py against the local mock Azure endpoint.
+
+Starts the mock LLM and fake search page, launches api/server.py under
+uvicorn with N workers pointed at them (a local .env can't redirect it),
+then drives concurrent users that each create a chat and send messages over
+SSE. Reports p50/p95/p99 turn latency, time to first streamed token and
+turns per second.
+
+    python -m bench.load_api --workers 4 --users 32 --turns 5 --depth Standard
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.fake_search import start_fake_search
+from bench.mock_azure import MockConfig, start_mock_azure
+from bench.run_bench import PROMPTS, ROLE
+from utils.metrics import percentile
+
+
+_MOCK_ENV = "DARK_AI_LOAD_MOCK_ENV"
+
+
+def _server_env(azure_url: str, search_url: str, db_path: str) -> Dict[str, str]:
+    mock = {
+        "AZURE_OPENAI_ENDPOINT": azure_url,
+        "AZURE_OPENAI_API_KEY": "mock-key",
+        "AZURE_OPENAI_DEPLOYMENT": "mock-deployment",
+        "WEB_SEARCH_URL": search_url,
+        "LLM_CACHE": "off",
+        "WEB_SEARCH_CACHE": "off",
+        "CHAT_STORE": "sqlite",  # shared by all workers
+        "CHAT_DB_PATH": db_path,
+        "API_TOKEN": "",
+    }
+    env = dict(os.environ)
+    env.update(mock)
+    env[_MOCK_ENV] = json.dumps(mock)
+    env["PYTHON_DOTENV_DISABLED"] = "1"  # python-dotenv >= 1.2; mock_server_app covers older versions
+    return env
+
+
+def mock_server_app():
+    """
+    uvicorn factory run in each worker: api.server with the mock env applied
+    again after utils.azure_client's load_dotenv(override=True), as in run_bench.
+    """
+    import utils.azure_client  # noqa: F401  (loads a local .env over the environment)
+    mock = json.loads(os.environ[_MOCK_ENV])
+    os.environ.update(mock)
+    from utils import web_search
+    web_search.SEARCH_URL = mock["WEB_SEARCH_URL"]
+    from api.server import app
+    return app
+
+
+async def _wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base}/healthz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API server did not start")
+
+
+async def _turn(client: httpx.AsyncClient, base: str, chat_id: str, text: str, depth: str) -> Dict:
+    started = time.monotonic()
+    first = None
+    ok = False
+    event = ""
+    async with client.stream("POST", f"{base}/chats/{chat_id}/messages",
+                             json={"content": text, "depth": depth}) as resp:
+        if resp.status_code != 200:
+            return {"ok": False, "latency": time.monotonic() - started, "ttft": None}
+        async for line in resp.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "delta" and first is None:
+                    first = time.monotonic() - started
+                elif event == "done":
+                    ok = bool(json.loads(line[6:]).get("reply"))
+    return {"ok": ok, "latency": time.monotonic() - started, "ttft": first}
+
+
+async def _user(client: httpx.AsyncClient, base: str, uid: int, args) -> List[Dict]:
+    resp = await client.post(f"{base}/chats", json={"role": ROLE, "settings": {"reasoning_depth": args.depth}})
+    resp.raise_for_status()
+    chat_id = resp.json()["id"]
+    runs = []
+    for i in range(args.turns):
+        try:
+            runs.append(await _turn(client, base, chat_id, f"{PROMPTS[(uid + i) % len(PROMPTS)]} (user {uid})",
+                                    args.depth))
+        except httpx.HTTPError:
+            runs.append({"ok": False, "latency": 0.0, "ttft": None})
+    return runs
+
+
+async def _drive(base: str, args) -> Dict:
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0), limits=limits) as client:
+        await _wait_ready(client, base)
+        started = time.monotonic()
+        per_user = await asyncio.gather(*[_user(client, base, u, args) for u in range(args.users)])
+        wall = time.monotonic() - started
+    runs = [r for user in per_user for r in user]
+    ok = [r for r in runs if r["ok"]]
+    lat = [r["latency"] for r in ok]
+    ttft = [r["ttft"] for r in ok if r["ttft"] is not None]
+    return {
+        "turns": len(runs),
+        "errors": len(runs) - len(ok),
+        "p50_s": percentile(lat, 50),
+        "p95_s": percentile(lat, 95),
+        "p99_s": percentile(lat, 99),
+        "ttft_p50_s": percentile(ttft, 50),
+        "ttft_p95_s": percentile(ttft, 95),
+        "turns_per_s": len(ok) / wall if wall else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    ap.add_argument("--users", type=int, default=16, help="concurrent users (one chat each)")
+    ap.add_argument("--turns", type=int, default=3, help="messages per user")
+    ap.add_argument("--depth", default="Standard")
+    ap.add_argument("--port", type=int, default=8011)
+    ap.add_argument("--ttft", type=float, default=0.3, help="mock time to first token (s)")
+    ap.add_argument("--tps", type=float, default=80.0, help="mock tokens per second")
+    ap.add_argument("--search-latency", type=float, default=0.15)
+    ap.add_argument("--json", dest="json_out", help="write the report as JSON to this path")
+    args = ap.parse_args(argv)
+
+    azure = start_mock_azure(MockConfig(ttft=args.ttft, tokens_per_sec=args.tps))
+    search = start_fake_search(latency=args.search_latency)
+    tmp = tempfile.mkdtemp(prefix="dark-ai-load-")
+    env = _server_env(f"http://127.0.0.1:{azure.server_port}",
+                      f"http://127.0.0.1:{search.server_port}/sp/search", os.path.join(tmp, "chats.sqlite"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.load_api:mock_server_app", "--factory", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        report = asyncio.run(_drive(f"http://127.0.0.1:{args.port}", args))
+    finally:
+        server.terminate()
+        server.wait(timeout=15)
+        azure.shutdown()
+        search.shutdown()
+
+    report["config"] = vars(args)
+    for k, v in report.items():
+        if k != "config":
+            print(f"{k:>12}: {v:.3f}" if isinstance(v, float) else f"{k:>12}: {v}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# bench/mock_azure.py
+"""
+Local OpenAI/Azure-compatible chat completions stub for benchmarks.
+
+Serves POST /openai/deployments/<name>/chat/completions (streaming SSE or
+plain JSON) with configurable time-to-first-token, token rate, jitter and
+failure injection. Planner/clarity/judge (and combined planner) prompts get
+canned JSON so the whole pipeline runs end to end.
+
+    python -m bench.mock_azure --port 8788 --tps 80 --ttft 0.25
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+FILLER = (
+    "The void considered your question carefully and concluded that the answer involves "
+    "several practical steps, a little patience and an unreasonable amount of coffee. "
+).split()
+
+
+@dataclass
+class MockConfig:
+    ttft: float = 0.3             # seconds before the first token
+    tokens_per_sec: float = 60.0  # streaming rate after the first token
+    jitter: float = 0.2           # +/- fraction applied to each delay
+    answer_tokens: int = 180      # length of free-text answers
+    fail_rate: float = 0.0        # fraction of requests that fail
+    fail_status: int = 429        # 429 (with Retry-After) or 5xx
+    retry_after: float = 1.0
+    search: bool = True           # planner asks for web search
+    bad_json_rate: float = 0.0    # fraction of JSON replies sent truncated (exercises repair)
+
+
+def _canned_reply(messages: List[dict], cfg: MockConfig) -> Optional[str]:
+    system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    if "combined planner" in system:
+        return json.dumps({"need_info": False, "questions": [], "reason": "enough detail", "plan": _plan(cfg)})
+    if "need_info" in system:
+        return json.dumps({"need_info": False, "questions": [], "reason": "enough detail"})
+    if "task planner" in system:
+        return json.dumps(_plan(cfg))
+    if "answer judge" in system:
+        return json.dumps({"ok": True, "needs_fix": False, "issues": []})
+    return None
+
+
+def _plan(cfg: MockConfig) -> dict:
+    return {
+        "objective": "Answer the user", "assumptions": [], "steps": ["answer"], "subproblems": [],
+        "data_to_verify": [], "quality_checks": [],
+        "web_plan": {"should_search": cfg.search, "queries": ["dark ai benchmark", "mock search query"]},
+    }
+
+
+def _answer_tokens(n: int) -> List[str]:
+    return [FILLER[i % len(FILLER)] + " " for i in range(n)]
+
+
+def _sleep(base: float, cfg: MockConfig) -> None:
+    if base > 0:
+        time.sleep(max(0.0, base * (1 + random.uniform(-cfg.jitter, cfg.jitter))))
+
+
+def make_handler(cfg: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, payload: dict, headers: Optional[dict] = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if "/chat/completions" not in self.path:
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if cfg.fail_rate and random.random() < cfg.fail_rate:
+                headers = {"Retry-After": f"{cfg.retry_after:g}"} if cfg.fail_status == 429 else {}
+                self._json(cfg.fail_status, {"error": {"code": str(cfg.fail_status), "message": "injected failure"}}, headers)
+                return
+
+            messages = req.get("messages", [])
+            canned = _canned_reply(messages, cfg)
+            if canned is not None and cfg.bad_json_rate and random.random() < cfg.bad_json_rate:
+                canned = canned[: len(canned) // 2]
+            if canned is not None:
+                pieces = [canned[i:i + 16] for i in range(0, len(canned), 16)]
+            else:
+                limit = req.get("max_tokens") or cfg.answer_tokens
+                pieces = _answer_tokens(min(limit, cfg.answer_tokens))
+            prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                     "total_tokens": prompt_tokens + len(pieces)}
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            model = req.get("model", "mock")
+
+            if not req.get("stream"):
+                _sleep(cfg.ttft + len(pieces) / cfg.tokens_per_sec, cfg)
+                self._json(200, {
+                    "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(pieces)}}],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def send(obj):
+                data = obj if isinstance(obj, str) else json.dumps(obj)
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def chunk(delta, finish=None):
+                return {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+            try:
+                _sleep(cfg.ttft, cfg)
+                for piece in pieces:
+                    send(chunk({"content": piece}))
+                    _sleep(1.0 / cfg.tokens_per_sec, cfg)
+                send(chunk({}, "stop"))
+                if (req.get("stream_options") or {}).get("include_usage"):
+                    send({"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                          "model": model, "choices": [], "usage": usage})
+                send("[DONE]")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def start_mock_azure(cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the stub in a daemon thread; port 0 picks a free port (see server.server_port).
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-azure", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8788)
+    ap.add_argument("--ttft", type=float, default=0.3)
+    ap.add_argument("--tps", type=float, default=60.0, help="tokens per second")
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--answer-tokens", type=int, default=180)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--fail-status", type=int, default=429)
+    ap.add_argument("--no-search", action="store_true", help="planner never asks for web search")
+    ap.add_argument("--bad-json-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    cfg = MockConfig(ttft=args.ttft, tokens_per_sec=args.tps, jitter=args.jitter, answer_tokens=args.answer_tokens,
+                     fail_rate=args.fail_rate, fail_status=args.fail_status, search=not args.no_search,
+                     bad_json_rate=args.bad_json_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    print(f"mock Azure OpenAI on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# bench/run_bench.py
+"""
+Offline latency benchmark for the Fast / Standard / Deep pipelines.
+
+Starts a mock Azure OpenAI endpoint and a fake search page on localhost,
+drives utils.pipeline headlessly and reports p50/p95/p99 turn latency,
+time to first answer token, throughput and tokens per turn.
+
+    python -m bench.run_bench --turns 30 --concurrency 4 --depths Fast,Standard,Deep
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict
+
+from bench.fake_search import start_fake_search
+from bench.mock_azure import MockConfig, start_mock_azure
+from utils.metrics import percentile
+
+ROLE = "You are a concise, practical assistant for software engineers."
+PROMPTS = [
+    "How do I speed up a slow Python test suite?",
+    "Explain HTTP keep-alive in two paragraphs.",
+    "What changed in the latest Streamlit release?",
+    "Give me a checklist for reviewing a pull request.",
+    "Compare SQLite WAL mode with the default journal mode.",
+]
+
+
+def _point_at_mocks(azure_url: str, search_url: str, cache: bool) -> None:
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": azure_url,
+        "AZURE_OPENAI_API_KEY": "mock-key",
+        "AZURE_OPENAI_DEPLOYMENT": "mock-deployment",
+        "WEB_SEARCH_URL": search_url,
+    })
+    if not cache:
+        os.environ["LLM_CACHE"] = "off"
+        os.environ["WEB_SEARCH_CACHE"] = "off"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--depths", default="Fast,Standard,Deep")
+    ap.add_argument("--turns", type=int, default=20, help="turns per depth")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--ttft", type=float, default=0.3, help="mock time to first token (s)")
+    ap.add_argument("--tps", type=float, default=80.0, help="mock tokens per second")
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--answer-tokens", type=int, default=180)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--fail-status", type=int, default=429)
+    ap.add_argument("--bad-json-rate", type=float, default=0.0, help="fraction of planner/judge replies sent invalid")
+    ap.add_argument("--search-latency", type=float, default=0.15)
+    ap.add_argument("--no-web", action="store_true", help="disable the web search stage")
+    ap.add_argument("--fetch-pages", action="store_true", help="enable page extraction")
+    ap.add_argument("--no-speculative", action="store_true", help="run clarity check and planner sequentially")
+    ap.add_argument("--planner", choices=["split", "merged"], default="split",
+                    help="separate clarity + plan calls, or one combined call")
+    ap.add_argument("--speculative-search", action="store_true", help="search the raw prompt while planning")
+    ap.add_argument("--cache", action="store_true", help="keep LLM/search caches enabled")
+    ap.add_argument("--json", dest="json_out", help="write the report as JSON to this path")
+    args = ap.parse_args(argv)
+
+    cfg = MockConfig(ttft=args.ttft, tokens_per_sec=args.tps, jitter=args.jitter, answer_tokens=args.answer_tokens,
+                     fail_rate=args.fail_rate, fail_status=args.fail_status, search=not args.no_web,
+                     bad_json_rate=args.bad_json_rate)
+    azure = start_mock_azure(cfg)
+    search = start_fake_search(latency=args.search_latency)
+    azure_url = f"http://127.0.0.1:{azure.server_port}"
+    search_url = f"http://127.0.0.1:{search.server_port}/sp/search"
+    _point_at_mocks(azure_url, search_url, args.cache)
+
+    # Imported late so module-level config (caches, search URL) sees the mock env
+    from utils import web_search as web_search_mod
+    from utils.pipeline import PipelineHooks, TurnContext, run_turn
+    from utils.reasoning import anchored_history
+    _point_at_mocks(azure_url, search_url, args.cache)  # a local .env may have overridden them
+    web_search_mod.SEARCH_URL = search_url
+
+    class BenchHooks(PipelineHooks):
+        def __init__(self):
+            self.first_token_at = None
+
+        def on_delta(self, stage, text):
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+
+    def one_turn(depth: str, i: int) -> Dict:
+        text = f"{PROMPTS[i % len(PROMPTS)]} (turn {i})"
+        history = anchored_history(ROLE, [{"role": "system", "content": ROLE}, {"role": "user", "content": text}])
+        ctx = TurnContext(
+            role=ROLE, user_text=text, history=history, depth=depth,
+            do_web=not args.no_web, web_fetch_pages=args.fetch_pages,
+            speculative_plan=not args.no_speculative, planner_mode=args.planner,
+            speculative_search=args.speculative_search,
+        )
+        hooks = BenchHooks()
+        started = time.monotonic()
+        try:
+            run_turn(ctx, hooks)
+            ok = bool(ctx.final_text)
+        except Exception:
+            ok = False
+        ended = time.monotonic()
+        totals = ctx.metrics.totals()
+        return {
+            "ok": ok,
+            "latency": ended - started,
+            "ttft": (hooks.first_token_at - started) if hooks.first_token_at else None,
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"],
+            "llm_calls": totals["llm_calls"],
+        }
+
+    report = {"config": vars(args), "depths": {}}
+    for depth in [d.strip() for d in args.depths.split(",") if d.strip()]:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(one_turn, depth, i) for i in range(args.turns)]
+            runs = [f.result() for f in as_completed(futures)]
+        wall = time.monotonic() - started
+        ok_runs = [r for r in runs if r["ok"]]
+        lat = [r["latency"] for r in ok_runs]
+        ttft = [r["ttft"] for r in ok_runs if r["ttft"] is not None]
+        n = max(1, len(ok_runs))
+        report["depths"][depth] = {
+            "turns": len(runs),
+            "errors": len(runs) - len(ok_runs),
+            "p50_s": percentile(lat, 50),
+            "p95_s": percentile(lat, 95),
+            "p99_s": percentile(lat, 99),
+            "ttft_p50_s": percentile(ttft, 50),
+            "ttft_p95_s": percentile(ttft, 95),
+            "turns_per_s": len(ok_runs) / wall if wall else 0.0,
+            "prompt_tokens_per_turn": sum(r["prompt_tokens"] for r in ok_runs) / n,
+            "completion_tokens_per_turn": sum(r["completion_tokens"] for r in ok_runs) / n,
+            "llm_calls_per_turn": sum(r["llm_calls"] for r in ok_runs) / n,
+        }
+
+    _print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    azure.shutdown()
+    search.shutdown()
+    return 1 if any(d["errors"] for d in report["depths"].values()) else 0
+
+
+def _print_report(report: Dict) -> None:
+    cols = ["turns", "errors", "p50_s", "p95_s", "p99_s", "ttft_p50_s", "turns_per_s",
+            "prompt_tokens_per_turn", "completion_tokens_per_turn", "llm_calls_per_turn"]
+    print("depth     " + "  ".join(f"{c:>12}" for c in cols))
+    for depth, row in report["depths"].items():
+        cells = []
+        for c in cols:
+            v = row[c]
+            cells.append(f"{'-':>12}" if v is None else (f"{v:>12.3f}" if isinstance(v, float) else f"{v:>12}"))
+        print(f"{depth:<10}" + "  ".join(cells))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,9 @@
 import streamlit as st
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from utils.chat_store import ChatSession
 
-
-def render_navbar(active_chat: Optional[ChatSession], browser_time: str, browser_hour: Optional[int]):
-    """
-    Text-only navbar (fixed at top). No sidebar toggle, no floating buttons.
-    """
-    msg_count = len(active_chat.messages) if active_chat else 0
-
-    # Fallback to server time if browser time isn't available
-    now = datetime.now()
-    time_display = browser_time or now.strftime("%I:%M:%S %p")
-    hour = browser_hour if browser_hour is not None else now.hour
-    vibe = (
-        "Wake ☕ suffer" if hour < 12
-        else ("Slave 🔗 routine" if hour < 18 else "Cry 🌙 repeat")
-    )
-
-    # ---- Styles ----
-    st.markdown(
-        """
+NAVBAR_CSS = """
         <style>
           :root { --dark-nav-height: 50px; }
 
@@ -65,8 +47,37 @@ def render_navbar(active_chat: Optional[ChatSession], browser_time: str, browser
 
           html { scroll-behavior: smooth; }
         </style>
-        """,
-        unsafe_allow_html=True,
+        """
+
+
+def inject_navbar_styles():
+    """
+    Navbar CSS. Emit once per full script run, outside any fragment, so
+    navbar refreshes only resend the bar itself.
+    """
+    st.markdown(NAVBAR_CSS, unsafe_allow_html=True)
+
+
+def render_navbar(active_chat: Optional[ChatSession], browser_time: str, browser_hour: Optional[int],
+                  tz_offset_min: Optional[int] = None):
+    """
+    Text-only navbar (fixed at top). No sidebar toggle, no floating buttons.
+    With the browser's UTC offset (JS getTimezoneOffset) the clock is live;
+    otherwise it shows the time captured when the session started.
+    """
+    msg_count = len(active_chat.messages) if active_chat else 0
+
+    if tz_offset_min is not None:
+        local = datetime.now(timezone.utc) - timedelta(minutes=tz_offset_min)
+        time_display, hour = local.strftime("%I:%M %p"), local.hour
+    else:
+        # Fallback to server time if browser time isn't available
+        now = datetime.now()
+        time_display = browser_time or now.strftime("%I:%M:%S %p")
+        hour = browser_hour if browser_hour is not None else now.hour
+    vibe = (
+        "Wake ☕ suffer" if hour < 12
+        else ("Slave 🔗 routine" if hour < 18 else "Cry 🌙 repeat")
     )
 
     # ---- Navbar + Spacer ----
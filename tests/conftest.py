@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# The app runs from the repo root (`streamlit run app.py`); mirror that for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,95 @@
+# tests/test_chat_store.py
+import pytest
+
+from utils.chat_store import ChatStore, MemoryChatStore, SQLiteChatStore, new_chat
+
+
+def _say(chat, *texts):
+    for i, text in enumerate(texts):
+        chat.messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": text})
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "chats.sqlite")
+
+
+def test_sync_then_load_round_trips_messages_and_settings(db):
+    store = SQLiteChatStore(db)
+    chat = new_chat("You are a Python tutor.")
+    chat.reasoning_depth, chat.temperature = "Deep", 0.2
+    _say(chat, "What is a generator?", "A lazy iterator.")
+    store.sync(chat)
+
+    loaded = SQLiteChatStore(db).load_chat(chat.id)
+    assert [m["content"] for m in loaded.messages] == ["What is a generator?", "A lazy iterator."]
+    assert (loaded.reasoning_depth, loaded.temperature) == ("Deep", 0.2)
+    assert loaded.persisted_count == 2
+    assert SQLiteChatStore(db).list_chats() == [(chat.id, chat.title)]
+
+
+def test_sync_only_appends_new_messages(db):
+    store = SQLiteChatStore(db)
+    chat = new_chat("role")
+    _say(chat, "one", "two")
+    store.sync(chat)
+    _say(chat, "three", "four")
+    store.sync(chat)
+    store.sync(chat)  # nothing new
+    assert [m["content"] for m in store.load_chat(chat.id).messages] == ["one", "two", "three", "four"]
+
+
+def test_concurrent_writers_never_overwrite_each_other(db):
+    first, second = SQLiteChatStore(db), SQLiteChatStore(db)
+    chat = new_chat("role")
+    _say(chat, "hello")
+    first.sync(chat)
+
+    a, b = first.load_chat(chat.id), second.load_chat(chat.id)
+    _say(a, "A?", "A!")
+    _say(b, "B?", "B!")
+    first.sync(a)
+    second.sync(b)
+
+    expected = ["hello", "A?", "A!", "B?", "B!"]
+    assert [m["content"] for m in first.load_chat(chat.id).messages] == expected
+    # the stale writer picked up the other exchange
+    assert [m["content"] for m in b.messages] == expected
+    assert b.persisted_count == len(expected)
+
+
+def test_truncated_history_drops_the_logged_tail(db):
+    store = SQLiteChatStore(db)
+    chat = new_chat("role")
+    _say(chat, "one", "two", "three")
+    store.sync(chat)
+    del chat.messages[1:]
+    store.sync(chat)
+    assert [m["content"] for m in store.load_chat(chat.id).messages] == ["one"]
+
+
+def test_delete_chat(db):
+    store = SQLiteChatStore(db)
+    chat = new_chat("role")
+    _say(chat, "one")
+    store.sync(chat)
+    store.delete_chat(chat.id)
+    assert store.load_chat(chat.id) is None
+    assert store.list_chats() == []
+
+
+def test_memory_store_sync_marks_messages_persisted():
+    store = MemoryChatStore()
+    chat = new_chat("role")
+    _say(chat, "one", "two")
+    store.sync(chat)
+    assert store.load_chat(chat.id) is chat and chat.persisted_count == 2
+
+
+def test_incomplete_store_fails_at_construction():
+    class Partial(ChatStore):
+        def list_chats(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,87 @@
+# tests/test_page_extract.py
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.page_extract import best_passages, enrich_results, extract_blocks, fetch_html
+from utils.web_search import SearchResult
+
+ARTICLE = """<html><head><style>p { color: red }</style><script>var x = "script text that is long enough";</script></head>
+<body>
+<nav><p>Home | About | Contact | Subscribe to our newsletter today</p></nav>
+<h1>Python generators explained for people in a hurry</h1>
+<p>A generator is a function that yields values lazily, one at a time, instead of building a list.</p>
+<p>Unrelated paragraph about gardening, tomatoes, and the correct way to water them.</p>
+<p>Generators keep their local state between yields, which makes them ideal for streaming pipelines.</p>
+<footer><p>Copyright 2024 Example Corp. All rights reserved worldwide forever.</p></footer>
+</body></html>"""
+
+PAGES = {
+    "/article": ("text/html; charset=utf-8", ARTICLE),
+    "/data.json": ("application/json", '{"not": "html"}'),
+    "/big": ("text/html", "<p>" + "x" * 50_000 + "</p>"),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in PAGES:
+            self.send_error(404)
+            return
+        ctype, body = PAGES[self.path]
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_extract_blocks_drops_boilerplate():
+    blocks = extract_blocks(ARTICLE)
+    assert any("yields values lazily" in b for b in blocks)
+    assert not any("Subscribe" in b or "Copyright" in b or "script text" in b for b in blocks)
+
+
+def test_best_passages_prefers_matching_blocks_in_document_order():
+    blocks = extract_blocks(ARTICLE)
+    text = best_passages(blocks, "generators yields lazily state", max_chars=1000)
+    assert "gardening" not in text
+    assert text.index("yields values lazily") < text.index("local state")
+    assert len(best_passages(blocks, "generators", max_chars=50)) <= 50
+
+
+def test_best_passages_falls_back_to_lead_paragraphs():
+    blocks = ["First paragraph with enough text to count as content.", "Second paragraph, also long enough here."]
+    assert best_passages(blocks, "zzz qqq", max_chars=60).startswith("First paragraph")
+
+
+def test_fetch_html_reads_html_and_skips_other_types(site):
+    assert "Python generators explained" in fetch_html(f"{site}/article")
+    assert fetch_html(f"{site}/data.json") == ""
+
+
+def test_fetch_html_stops_at_max_bytes(site):
+    assert len(fetch_html(f"{site}/big", max_bytes=1000)) == 1000
+
+
+def test_enrich_results_replaces_extracts_and_keeps_snippet_on_failure(site):
+    results = [
+        SearchResult("Article", f"{site}/article", "snippet", "snippet extract"),
+        SearchResult("Gone", f"{site}/missing", "snippet", "snippet extract"),
+    ]
+    enrich_results(results, "generator yields lazily", extract_chars=300, timeout=2)
+    assert "yields values lazily" in results[0].extract
+    assert results[1].extract == "snippet extract"
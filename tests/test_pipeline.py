@@ -0,0 +1,122 @@
+# tests/test_pipeline.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import pipeline
+from utils.pipeline import SEARCH, SPECULATIVE_SEARCH, SpeculationBudget, Stage, TurnContext, run_turn
+from utils.web_search import SearchResult
+
+
+def _result(url):
+    return SearchResult(title=url, url=url, snippet="", extract="")
+
+
+def _plan_stage(should_search, queries=()):
+    async def plan(ctx, runner):
+        ctx.plan = {"web_plan": {"should_search": should_search, "queries": list(queries)}}
+    return Stage("reason_plan", plan)
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """
+    Fake search backend: raw-message query -> spec results, others per `planned`.
+    """
+    calls = {"live": []}
+    state = {"spec": [_result("https://a"), _result("https://b")], "planned": {}}
+
+    def web_search_many(queries, **kwargs):
+        calls["live"].append(list(queries))
+        out = []
+        for q in queries:
+            out += state["spec"] if q == "python generators" else state["planned"].get(q, [])
+        return out, []
+
+    monkeypatch.setattr(pipeline, "web_search_many", web_search_many)
+    monkeypatch.setattr(pipeline, "SPECULATION_BUDGET", SpeculationBudget(10))
+    return calls, state
+
+
+def _ctx(**kw):
+    return TurnContext(role="tutor", user_text="Can you explain python generators?", history=[],
+                       speculative_search=True, **kw)
+
+
+def test_planned_results_come_first_and_speculative_results_fill_gaps(searches):
+    calls, state = searches
+    state["planned"]["generator send"] = [_result("https://planned"), _result("https://a")]
+    ctx = _ctx()
+    run_turn(ctx, stages=[SPECULATIVE_SEARCH, _plan_stage(True, ["generator send", "yield from"]), SEARCH])
+    assert calls["live"] == [["python generators"], ["generator send", "yield from"]]
+    # planned sources first, duplicates dropped
+    assert [r.url for r in ctx.results] == ["https://planned", "https://a", "https://b"]
+    assert ctx.used_web and ctx.speculative is None
+
+
+def test_speculative_results_only_fill_up_to_the_source_cap(searches):
+    _, state = searches
+    state["planned"]["generator send"] = [_result("https://planned")]
+    ctx = _ctx(max_queries=1, web_results_per_query=2)
+    run_turn(ctx, stages=[SPECULATIVE_SEARCH, _plan_stage(True, ["generator send"]), SEARCH])
+    assert [r.url for r in ctx.results] == ["https://planned", "https://a"]
+
+
+def test_planned_queries_run_when_speculation_found_nothing(searches):
+    calls, state = searches
+    state["spec"] = []
+    state["planned"]["yield from"] = [_result("https://planned")]
+    ctx = _ctx()
+    run_turn(ctx, stages=[SPECULATIVE_SEARCH, _plan_stage(True, ["yield from", "Python generators"]), SEARCH])
+    # the planned copy of the speculative query is not searched twice
+    assert calls["live"] == [["python generators"], ["yield from"]]
+    assert [r.url for r in ctx.results] == ["https://planned"]
+
+
+def test_unwanted_speculation_is_discarded_and_capped(searches, monkeypatch):
+    calls, _ = searches
+    monkeypatch.setattr(pipeline, "SPECULATION_BUDGET", SpeculationBudget(1))
+    for _ in range(2):
+        ctx = _ctx()
+        run_turn(ctx, stages=[SPECULATIVE_SEARCH, _plan_stage(False), SEARCH])
+        assert ctx.results == [] and ctx.speculative is None
+    # the first wasted search spent the budget, so the second turn didn't speculate
+    assert len(calls["live"]) == 1
+
+
+def test_no_speculation_without_web_or_after_clarification(searches):
+    calls, _ = searches
+    for ctx in (_ctx(do_web=False), _ctx(after_clarification=True)):
+        run_turn(ctx, stages=[SPECULATIVE_SEARCH, _plan_stage(False)])
+    assert calls["live"] == []
+
+
+def test_unknown_depth_is_rejected():
+    with pytest.raises(ValueError):
+        run_turn(TurnContext(role="r", user_text="hi", history=[], depth="deep"), stages=[])
+
+
+def test_a_turn_where_no_stage_ran_is_an_error():
+    with pytest.raises(RuntimeError):
+        run_turn(TurnContext(role="r", user_text="hi", history=[], depth="Fast"), stages=[SEARCH])
+
+
+def _blocking_stage(name, seconds, timeout):
+    async def work(ctx, runner):
+        await runner.call(time.sleep, seconds)
+    return Stage(name, work, timeout=timeout, required=True)
+
+
+def test_time_queued_behind_a_busy_pool_does_not_count_against_the_timeout():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pool.submit(time.sleep, 0.5)  # another turn holds the only thread
+        ctx = _ctx(do_web=False)
+        run_turn(ctx, stages=[_blocking_stage("quick", 0.05, timeout=0.3)], executor=pool)
+        assert ctx.timings["quick"] >= 0.5
+
+
+def test_stage_work_still_times_out():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(TimeoutError, match="slow timed out"):
+            run_turn(_ctx(do_web=False), stages=[_blocking_stage("slow", 0.5, timeout=0.1)], executor=pool)
@@ -0,0 +1,82 @@
+# tests/test_rate_limit.py
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from utils import azure_client
+from utils.rate_limit import PRIORITY_ANSWER, PRIORITY_DECORATIVE, RateLimiter, TokenBucket
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)  # one unit per second
+    now = time.monotonic()
+    bucket.consume(60, now)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 2) == 0.0
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.consume(10**9, time.monotonic())
+    assert bucket.wait_time(10**9, time.monotonic()) == 0.0
+
+
+def test_acquire_charges_the_estimate_and_settle_corrects_it():
+    limiter = RateLimiter(rpm=100, tpm=6000)
+    limiter.acquire(1000)
+    assert limiter.tokens.level == pytest.approx(5000, abs=5)
+    assert limiter.requests.level == pytest.approx(99, abs=0.1)
+    limiter.settle(1000, 200)  # real usage was lower: refund 800
+    assert limiter.tokens.level == pytest.approx(5800, abs=5)
+
+
+def test_higher_priority_waiter_goes_first():
+    limiter = RateLimiter(rpm=60)  # one request per second
+    limiter.requests.level = 0.0  # both callers have to queue
+    order = []
+
+    def call(priority, name):
+        limiter.acquire(0, priority)
+        order.append(name)
+
+    low = threading.Thread(target=call, args=(PRIORITY_DECORATIVE, "decorative"))
+    low.start()
+    time.sleep(0.05)
+    high = threading.Thread(target=call, args=(PRIORITY_ANSWER, "answer"))
+    high.start()
+    low.join(5)
+    high.join(5)
+    assert order == ["answer", "decorative"]
+
+
+def test_pause_holds_waiters():
+    limiter = RateLimiter()
+    limiter.pause(0.2)
+    started = time.monotonic()
+    limiter.acquire(0)
+    assert time.monotonic() - started >= 0.19
+
+
+def test_failed_attempts_are_refunded(monkeypatch):
+    limiter = RateLimiter(tpm=100_000)
+    monkeypatch.setattr(azure_client, "get_limiter", lambda label: limiter)
+    monkeypatch.setenv("AZURE_OPENAI_BACKOFF_BASE", "0.001")
+    attempts = []
+
+    def flaky(dep, messages, temperature, top_p, max_tokens, usage):
+        attempts.append(dep)
+        if len(attempts) < 3:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://azure.invalid"))
+        usage.update(prompt_tokens=30, completion_tokens=20)
+        yield "hello", None
+        yield "", "stop"
+
+    monkeypatch.setattr(azure_client, "_stream_from_azure", flaky)
+    level = limiter.tokens.level
+    text = "".join(piece for piece, _ in azure_client.stream_chat_completion([{"role": "user", "content": "hi"}]))
+    assert text == "hello" and len(attempts) == 3
+    # only the successful attempt's real usage stays charged
+    assert level - limiter.tokens.level == pytest.approx(50, abs=1)
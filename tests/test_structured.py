@@ -0,0 +1,95 @@
+# tests/test_structured.py
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils import azure_client, structured
+from utils.cache import MemoryCache
+from utils.rate_limit import RateLimiter
+from utils.reasoning import CLARITY_SCHEMA, PLAN_SCHEMA, empty_plan
+from utils.structured import parse_json, request_json, validate
+
+CLARITY_OK = {"need_info": True, "questions": ["Which Python version?"], "reason": "version matters"}
+
+
+def test_validate_accepts_the_fallback_plan():
+    assert validate(empty_plan(), PLAN_SCHEMA) is None
+
+
+@pytest.mark.parametrize("value, error", [
+    ({"questions": [], "reason": ""}, "$: missing key 'need_info'"),
+    ({"need_info": "yes", "questions": [], "reason": ""}, "$.need_info: expected boolean, got str"),
+    ({"need_info": False, "questions": [1], "reason": ""}, "$.questions[0]: expected string, got int"),
+    ([], "$: expected object, got list"),
+])
+def test_validate_reports_the_first_error_with_its_path(value, error):
+    assert validate(value, CLARITY_SCHEMA) == error
+
+
+def test_validate_keeps_bools_out_of_numbers_and_checks_enums():
+    assert validate(True, {"type": "integer"}) == "$: expected integer, got bool"
+    assert validate(3, {"type": "number"}) is None
+    assert validate("c", {"type": "string", "enum": ["a", "b"]}) == "$: must be one of ['a', 'b']"
+
+
+def test_parse_json_tolerates_code_fences():
+    data, err = parse_json("```json\n" + json.dumps(CLARITY_OK) + "\n```", CLARITY_SCHEMA)
+    assert err is None and data == CLARITY_OK
+
+
+def test_parse_json_reports_invalid_json():
+    data, err = parse_json('{"need_info": tru', CLARITY_SCHEMA)
+    assert data is None and err.startswith("not valid JSON")
+
+
+def _fake_completions(monkeypatch, replies):
+    calls = []
+
+    def fake(messages, schema=None, name="response", **kwargs):
+        calls.append(messages)
+        return replies[len(calls) - 1]
+
+    monkeypatch.setattr(structured, "complete_json", fake)
+    return calls
+
+
+def test_request_json_returns_valid_reply_without_repair(monkeypatch):
+    calls = _fake_completions(monkeypatch, [(json.dumps(CLARITY_OK), "stop")])
+    assert request_json([{"role": "user", "content": "q"}], CLARITY_SCHEMA, "clarity") == CLARITY_OK
+    assert len(calls) == 1
+
+
+def test_request_json_repairs_once_with_the_error(monkeypatch):
+    calls = _fake_completions(monkeypatch, [('{"need_info": true', "length"), (json.dumps(CLARITY_OK), "stop")])
+    assert request_json([{"role": "user", "content": "q"}], CLARITY_SCHEMA, "clarity") == CLARITY_OK
+    repair = calls[1]
+    assert repair[-2] == {"role": "assistant", "content": '{"need_info": true'}
+    assert "cut off at max_tokens" in repair[-1]["content"]
+
+
+def test_request_json_gives_up_after_one_repair(monkeypatch):
+    calls = _fake_completions(monkeypatch, [("nope", "stop"), ('{"need_info": 1}', "stop"), ("unused", "stop")])
+    assert request_json([{"role": "user", "content": "q"}], CLARITY_SCHEMA, "clarity") is None
+    assert len(calls) == 2
+
+
+def test_only_validated_replies_are_cached(monkeypatch):
+    replies = iter(['{"need_info": tru', json.dumps(CLARITY_OK), json.dumps(CLARITY_OK)])
+    sent = []
+
+    class Completions:
+        def create(self, **kwargs):
+            sent.append(kwargs["messages"])
+            message = SimpleNamespace(content=next(replies))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+    monkeypatch.setattr(azure_client, "get_client", lambda dep: client)
+    monkeypatch.setattr(azure_client, "get_limiter", lambda label: RateLimiter())
+    monkeypatch.setattr(azure_client, "_response_cache", MemoryCache())
+    question = [{"role": "user", "content": "q"}]
+    assert request_json(question, CLARITY_SCHEMA, "clarity") == CLARITY_OK  # invalid, then repaired
+    # the invalid first reply wasn't cached, so asking again goes back to the model
+    assert request_json(question, CLARITY_SCHEMA, "clarity") == CLARITY_OK
+    assert len(sent) == 3
@@ -1,18 +1,145 @@
+import hashlib
+import json
 import os
-from typing import Iterable, Tuple, Union
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+import httpx
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 
+from utils.cache import make_cache
+from utils.metrics import record_llm
+from utils.rate_limit import PRIORITY_ANSWER, PRIORITY_PLANNER, get_limiter, is_retryable, max_retries, on_retry
+from utils.routing import Deployment, Router, get_router
+from utils.tokens import count_message_tokens, count_tokens
+
 load_dotenv(override=True)
 
+# One client per (endpoint, api_version, api_key), shared by every Streamlit
+# session and rerun in this process so keep-alive connections are reused.
+_clients: Dict[Tuple[str, str, str], AzureOpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    val = os.getenv(name)
+    if val is None:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _build_http_client() -> httpx.Client:
+    """
+    Pooled httpx client. Pool size, keep-alive and HTTP/2 come from env:
+    AZURE_OPENAI_MAX_CONNECTIONS, AZURE_OPENAI_MAX_KEEPALIVE,
+    AZURE_OPENAI_KEEPALIVE_EXPIRY (seconds), AZURE_OPENAI_HTTP2.
+    """
+    limits = httpx.Limits(
+        max_connections=_env_int("AZURE_OPENAI_MAX_CONNECTIONS", 50),
+        max_keepalive_connections=_env_int("AZURE_OPENAI_MAX_KEEPALIVE", 20),
+        keepalive_expiry=float(_env_int("AZURE_OPENAI_KEEPALIVE_EXPIRY", 60)),
+    )
+    http2 = _env_flag("AZURE_OPENAI_HTTP2")
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx needs it for HTTP/2)
+        except ImportError:
+            http2 = False
+    timeout = httpx.Timeout(float(_env_int("AZURE_OPENAI_TIMEOUT", 120)), connect=10.0)
+    return httpx.Client(limits=limits, http2=http2, timeout=timeout)
+
 
-def get_client() -> AzureOpenAI:
-    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-    api_key = os.getenv("AZURE_OPENAI_API_KEY")
-    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
+def get_client(deployment: Optional[Deployment] = None) -> AzureOpenAI:
+    """
+    Pooled client for the deployment's endpoint/key/api-version (env defaults).
+    """
+    dep = deployment or Deployment("")
+    endpoint = dep.endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_key = os.getenv(dep.api_key_env or "AZURE_OPENAI_API_KEY")
+    api_version = dep.api_version or os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
     if not endpoint or not api_key:
-        raise RuntimeError("Missing AZURE_OPENAI_ENDPOINT or AZURE_OPENAI_API_KEY in environment.")
-    return AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version)
+        raise RuntimeError(
+            f"Missing endpoint or API key for deployment {dep.label or 'default'} "
+            "(AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_API_KEY)."
+        )
+
+    key = (endpoint, api_version, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = AzureOpenAI(
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                api_version=api_version,
+                http_client=_build_http_client(),
+                max_retries=0,  # retries go through utils.rate_limit (backoff + shared 429 pause)
+            )
+            _clients[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """
+    Close every pooled client (e.g. on shutdown or after rotating keys).
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
+
+
+# Content-addressed response cache: LLM_CACHE=memory|sqlite|off (+ _PATH, _TTL, _SIZE)
+_response_cache = make_cache("LLM_CACHE", table="llm_responses", default_ttl=3600, default_size=1024)
+REPLAY_CHUNK_CHARS = 64
+
+
+def response_cache_key(deployment: str, messages, temperature: float, top_p: float, max_tokens: Optional[int],
+                       response_format: Optional[dict] = None) -> str:
+    payload = json.dumps(
+        {"d": deployment, "m": messages, "t": temperature, "p": top_p, "n": max_tokens, "f": response_format},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _estimate_tokens(messages, max_tokens: Optional[int]) -> int:
+    """
+    Pre-flight TPM estimate; corrected with real usage via RateLimiter.settle().
+    """
+    return sum(count_message_tokens(m) for m in messages) + (max_tokens or 512)
+
+
+def _failover(router: Router, route: str, dep: Deployment, attempt: int, exc: BaseException) -> Deployment:
+    """
+    Back off after a retryable error and return the deployment for the next
+    try: another healthy one right away if the route has one, else the same
+    one after the backoff delay.
+    """
+    delay = on_retry(get_limiter(dep.label), attempt, exc)
+    if len(router.deployments(route)) > 1:
+        router.report_failure(dep)
+    nxt = router.pick(route)
+    if nxt == dep:
+        time.sleep(delay)
+    return nxt
+
+
+def response_cache_stats() -> dict:
+    return _response_cache.stats() if _response_cache is not None else {"hits": 0, "misses": 0, "size": 0}
 
 
 def stream_chat_completion(
@@ -20,26 +147,95 @@ def stream_chat_completion(
     temperature: float = 0.7,
     top_p: float = 1.0,
     max_tokens: int = None,
+    cache: bool = False,
+    cache_ttl: Optional[float] = None,
+    priority: int = PRIORITY_ANSWER,
+    route: str = "answer",
 ) -> Iterable[Tuple[str, Union[str, None]]]:
     """
     Yields (text_piece, finish_reason).
     - text_piece: a chunk of assistant text
     - finish_reason: None normally, or a string when the model ends
       (e.g., "stop", "length", "content_filter")
+    With `cache=True`, completed responses are stored by (deployment, messages,
+    sampling params) and later replayed as a stream without calling Azure.
+    Latency, time-to-first-token and token usage are reported to utils.metrics.
+    Calls queue in the deployment's rate limiter by `priority`; 429/5xx and
+    connection errors are retried only until the first chunk is yielded.
+    `route` picks the deployment set (see utils.routing).
     """
-    client = get_client()
-    deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
+    router = get_router()
+    key = None
+    if cache and _response_cache is not None:
+        key = response_cache_key(router.primary(route).name, messages, temperature, top_p, max_tokens)
+        hit = _response_cache.get(key)
+        if hit is not None:
+            record_llm(None, 0, 0, cache_hit=True)
+            text = hit["text"]
+            for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+                yield text[i:i + REPLAY_CHUNK_CHARS], None
+            yield "", hit["finish_reason"]
+            return
+
+    started = time.monotonic()
+    ttft = None
+    parts = []
+    usage: Dict[str, int] = {}
+    dep = router.pick(route)
+    est_tokens = _estimate_tokens(messages, max_tokens)
+    limiter = None  # the limiter the current attempt was charged to
+    try:
+        attempt = 0
+        while True:
+            acquiring = get_limiter(dep.label)
+            acquiring.acquire(est_tokens, priority)
+            limiter = acquiring
+            sent = time.monotonic()
+            try:
+                for piece, finish_reason in _stream_from_azure(dep, messages, temperature, top_p, max_tokens, usage):
+                    if piece and ttft is None:
+                        ttft = time.monotonic() - started
+                        router.report(route, dep, time.monotonic() - sent)
+                    parts.append(piece)
+                    if finish_reason == "stop" and key is not None:
+                        _response_cache.set(key, {"text": "".join(parts), "finish_reason": finish_reason}, ttl=cache_ttl)
+                    yield piece, finish_reason
+                break
+            except Exception as exc:
+                # Once the caller has seen text, a retry would duplicate it
+                if parts or attempt >= max_retries() or not is_retryable(exc):
+                    raise
+                limiter.settle(est_tokens, 0)  # a failed attempt used no tokens
+                limiter = None
+                dep = _failover(router, route, dep, attempt, exc)
+                attempt += 1
+    finally:
+        # Fall back to local counts when the API version doesn't report usage
+        prompt_tokens = usage.get("prompt_tokens") or sum(count_message_tokens(m) for m in messages)
+        completion_tokens = usage.get("completion_tokens") or count_tokens("".join(parts))
+        if limiter is not None:
+            limiter.settle(est_tokens, prompt_tokens + completion_tokens)
+        record_llm(ttft, prompt_tokens, completion_tokens, cache_hit=False)
 
+
+def _stream_from_azure(dep: Deployment, messages, temperature, top_p, max_tokens, usage: Dict[str, int]):
+    client = get_client(dep)
     stream = client.chat.completions.create(
-        model=deployment,
+        model=dep.name,
         messages=messages,
         temperature=temperature,
         top_p=top_p,
         max_tokens=max_tokens,
         stream=True,
+        stream_options={"include_usage": True},
     )
 
     for chunk in stream:
+        # The final chunk carries token usage and no choices
+        chunk_usage = getattr(chunk, "usage", None)
+        if chunk_usage:
+            usage["prompt_tokens"] = chunk_usage.prompt_tokens
+            usage["completion_tokens"] = chunk_usage.completion_tokens
         try:
             choice = chunk.choices[0]
 
@@ -55,3 +251,93 @@ def stream_chat_completion(
         except Exception:
             # Ignore malformed chunks (like tool calls or empty deltas)
             continue
+
+
+# JSON mode for planner/clarity/judge: AZURE_OPENAI_JSON_MODE=schema|json_object|off.
+# "schema" needs a model + api-version with structured outputs (gpt-4o 2024-08-06+).
+def _response_format(schema: Optional[dict], name: str) -> Optional[dict]:
+    mode = os.getenv("AZURE_OPENAI_JSON_MODE", "schema").strip().lower()
+    if mode == "off":
+        return None
+    if mode == "json_object" or schema is None:
+        return {"type": "json_object"}
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+
+
+def complete_json(
+    messages,
+    schema: Optional[dict] = None,
+    name: str = "response",
+    temperature: float = 0.0,
+    top_p: float = 1.0,
+    max_tokens: int = None,
+    cache: bool = False,
+    cache_ttl: Optional[float] = None,
+    priority: int = PRIORITY_PLANNER,
+    route: str = "planner",
+    accept: Optional[Callable[[str], bool]] = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    Non-streaming JSON completion. Returns (raw_text, finish_reason); the
+    caller validates (see utils.structured). Uses the same response cache and
+    metrics as stream_chat_completion; TTFT is the full request latency.
+    Only replies that finished and pass `accept` (the caller's validation)
+    are cached, so a bad reply isn't served again for the TTL.
+    Rate limiting and retries work as in stream_chat_completion.
+    """
+    router = get_router()
+    response_format = _response_format(schema, name)
+    key = None
+    if cache and _response_cache is not None:
+        key = response_cache_key(router.primary(route).name, messages, temperature, top_p, max_tokens, response_format)
+        hit = _response_cache.get(key)
+        if hit is not None:
+            record_llm(None, 0, 0, cache_hit=True)
+            return hit["text"], hit["finish_reason"]
+
+    started = time.monotonic()
+    text, finish_reason, usage = "", None, {}
+    dep = router.pick(route)
+    est_tokens = _estimate_tokens(messages, max_tokens)
+    extra = {"response_format": response_format} if response_format else {}
+    limiter = None  # the limiter the current attempt was charged to
+    try:
+        attempt = 0
+        while True:
+            acquiring = get_limiter(dep.label)
+            acquiring.acquire(est_tokens, priority)
+            limiter = acquiring
+            sent = time.monotonic()
+            try:
+                resp = get_client(dep).chat.completions.create(
+                    model=dep.name,
+                    messages=messages,
+                    temperature=temperature,
+                    top_p=top_p,
+                    max_tokens=max_tokens,
+                    **extra,
+                )
+                router.report(route, dep, time.monotonic() - sent)
+                break
+            except Exception as exc:
+                if attempt >= max_retries() or not is_retryable(exc):
+                    raise
+                limiter.settle(est_tokens, 0)  # a failed attempt used no tokens
+                limiter = None
+                dep = _failover(router, route, dep, attempt, exc)
+                attempt += 1
+        if resp.choices:
+            choice = resp.choices[0]
+            text = (choice.message.content or "") if choice.message else ""
+            finish_reason = choice.finish_reason
+        if resp.usage:
+            usage = {"prompt_tokens": resp.usage.prompt_tokens, "completion_tokens": resp.usage.completion_tokens}
+    finally:
+        prompt_tokens = usage.get("prompt_tokens") or sum(count_message_tokens(m) for m in messages)
+        completion_tokens = usage.get("completion_tokens") or count_tokens(text)
+        if limiter is not None:
+            limiter.settle(est_tokens, prompt_tokens + completion_tokens)
+        record_llm(time.monotonic() - started, prompt_tokens, completion_tokens, cache_hit=False)
+    if key is not None and finish_reason == "stop" and (accept is None or accept(text)):
+        _response_cache.set(key, {"text": text, "finish_reason": finish_reason}, ttl=cache_ttl)
+    return text, finish_reason
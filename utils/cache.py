@@ -0,0 +1,135 @@
+# utils/cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU with per-entry TTL.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class SQLiteCache:
+    """
+    On-disk cache shared across processes. Values must be JSON-serializable.
+    Least-recently-used rows beyond `max_entries` are evicted on write.
+    """
+
+    def __init__(self, path: str, table: str = "cache", max_entries: int = 10000, ttl: float = 3600):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, payload, expires, now),
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+def make_cache(prefix: str, table: str, default_ttl: float, default_size: int):
+    """
+    Build a cache from env vars `<prefix>` (memory | sqlite | off),
+    `<prefix>_PATH`, `<prefix>_TTL` and `<prefix>_SIZE`. Returns None when off.
+    """
+    kind = os.getenv(prefix, "memory").strip().lower()
+    ttl = float(os.getenv(f"{prefix}_TTL", default_ttl))
+    size = int(os.getenv(f"{prefix}_SIZE", default_size))
+    if kind in ("off", "none", "0", "false"):
+        return None
+    if kind == "sqlite":
+        path = os.getenv(f"{prefix}_PATH", os.path.join(".cache", "dark_ai_cache.sqlite"))
+        return SQLiteCache(path, table=table, max_entries=size, ttl=ttl)
+    return MemoryCache(max_entries=size, ttl=ttl)
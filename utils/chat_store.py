@@ -1,6 +1,15 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
 import uuid
+from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from utils.tokens import count_message_tokens, history_budget
 
 @dataclass
 class ChatSession:
@@ -8,17 +17,323 @@ class ChatSession:
     title: str
     role: str                  # the "system" role text the user provides
     messages: List[Dict] = field(default_factory=list)  # OpenAI-style messages
+    # token_counts[i] caches the token cost of messages[i]; filled incrementally
+    token_counts: List[int] = field(default_factory=list, repr=False)
+    # "window": recent messages only; "summary": running summary + recent messages
+    memory_mode: str = "window"
+    summary: str = ""
+    summary_upto: int = 0          # messages[:summary_upto] are folded into `summary`
+    summary_fingerprint: str = ""  # hash of those messages, to detect edits
+    # per-chat settings (persisted with the chat)
+    temperature: float = 0.7
+    top_p: float = 1.0
+    use_web_search: bool = True
+    web_results_per_query: int = 5
+    web_extract_chars: int = 900
+    web_fetch_pages: bool = False
+    reasoning_depth: str = "Standard"  # Fast | Standard | Deep | Auto
+    speculative_plan: bool = True
+    planner_mode: str = "split"  # split | merged (one plan + clarity call)
+    speculative_search: bool = False  # search the raw message while planning
+    created_at: float = field(default_factory=time.time)
+    # number of messages already written to the store (append-only log)
+    persisted_count: int = field(default=0, repr=False)
+    # (messages list, its length) when the summarized prefix last matched its
+    # fingerprint; appends keep that valid, a replaced or shorter list rechecks
+    _summary_checked: Optional[Tuple[list, int]] = field(default=None, repr=False, compare=False)
 
     def system_message(self):
         return {"role": "system", "content": self.role}
 
-    def messages_for_model(self, max_pairs: int = 40) -> List[Dict]:
+    def _prefix_fingerprint(self, upto: int) -> str:
+        h = hashlib.sha1()
+        for m in self.messages[:upto]:
+            h.update(f"{m['role']}\x00{m.get('content') or ''}\x01".encode("utf-8"))
+        return h.hexdigest()
+
+    def summary_is_valid(self) -> bool:
+        """
+        The summarized prefix is only rehashed when the message list was
+        replaced or shrank since the last check (or after messages_edited()).
+        """
+        if not self.summary or self.summary_upto > len(self.messages):
+            return False
+        checked = self._summary_checked
+        if checked and checked[0] is self.messages and checked[1] <= len(self.messages):
+            self._summary_checked = (self.messages, len(self.messages))
+            return True
+        if self._prefix_fingerprint(self.summary_upto) != self.summary_fingerprint:
+            return False
+        self._summary_checked = (self.messages, len(self.messages))
+        return True
+
+    def messages_edited(self) -> None:
+        """
+        Call after editing messages in place so the summary is re-verified.
+        """
+        self._summary_checked = None
+
+    def apply_summary(self, text: str, upto: int) -> None:
+        """
+        Record that messages[:upto] are now represented by `text`.
+        """
+        fingerprint = self._prefix_fingerprint(upto)
+        self.summary, self.summary_upto, self.summary_fingerprint = text.strip(), upto, fingerprint
+        self._summary_checked = (self.messages, len(self.messages))
+
+    def clear_summary(self) -> None:
+        self.summary, self.summary_upto, self.summary_fingerprint = "", 0, ""
+        self._summary_checked = None
+
+    def _refresh_token_counts(self) -> None:
+        if len(self.token_counts) > len(self.messages):
+            self.token_counts = []  # history was truncated/replaced; recount
+        for m in self.messages[len(self.token_counts):]:
+            self.token_counts.append(count_message_tokens(m))
+
+    def messages_for_model(self, max_pairs: int = 40, max_tokens: Optional[int] = None) -> List[Dict]:
         """
-        Returns system + the last `max_pairs` (user/assistant) messages.
+        Returns system + the most recent (user/assistant) messages that fit in
+        `max_tokens` (default: the deployment's history budget), capped at
+        `max_pairs` pairs. The newest message is always included.
+        In "summary" memory mode, older messages are replaced by the running
+        summary and only messages after it are considered.
         """
-        non_system = [m for m in self.messages if m["role"] in ("user", "assistant")]
-        trimmed = non_system[-(max_pairs*2):]  # roughly pairs
-        return [self.system_message()] + trimmed
+        self._refresh_token_counts()
+        budget = history_budget() if max_tokens is None else max_tokens
+        budget -= count_message_tokens(self.system_message())
+
+        head = [self.system_message()]
+        first = 0
+        if self.memory_mode == "summary" and self.summary:
+            if self.summary_is_valid():
+                summary_msg = {"role": "system", "content": f"CONVERSATION SUMMARY (earlier turns):\n{self.summary}"}
+                head.append(summary_msg)
+                budget -= count_message_tokens(summary_msg)
+                first = self.summary_upto
+            else:
+                self.clear_summary()  # older messages changed; fall back to the window
+
+        picked: List[Dict] = []
+        used = 0
+        for i in range(len(self.messages) - 1, first - 1, -1):
+            m = self.messages[i]
+            if m["role"] not in ("user", "assistant"):
+                continue
+            if len(picked) >= max_pairs * 2:
+                break
+            cost = self.token_counts[i]
+            if picked and used + cost > budget:
+                break
+            picked.append({"role": m["role"], "content": m["content"]})
+            used += cost
+        picked.reverse()
+        return head + picked
+
+# Fields saved as the chat's settings/state blob
+STATE_FIELDS = (
+    "temperature", "top_p", "use_web_search", "web_results_per_query", "web_extract_chars",
+    "web_fetch_pages", "reasoning_depth", "speculative_plan", "planner_mode", "speculative_search",
+    "memory_mode", "summary", "summary_upto", "summary_fingerprint",
+)
+
+
+def chat_state(chat: ChatSession) -> Dict:
+    return {k: getattr(chat, k) for k in STATE_FIELDS}
+
+
+class ChatStore(ABC):
+    """
+    Storage interface for chats. `list_chats` returns only (id, title) so the
+    sidebar never loads message bodies; `load_chat` pulls a full session.
+    """
+
+    @abstractmethod
+    def list_chats(self) -> List[Tuple[str, str]]:
+        ...
+
+    @abstractmethod
+    def load_chat(self, chat_id: str) -> Optional[ChatSession]:
+        ...
+
+    @abstractmethod
+    def save_chat(self, chat: ChatSession) -> None:
+        """
+        Upsert title/role/settings (not messages).
+        """
+
+    @abstractmethod
+    def sync(self, chat: ChatSession) -> None:
+        """
+        Save metadata and append any messages not yet written, in one batch.
+        """
+
+    @abstractmethod
+    def delete_chat(self, chat_id: str) -> None:
+        ...
+
+
+class MemoryChatStore(ChatStore):
+    """
+    Keeps chats in process memory only (the original behaviour).
+    """
+
+    def __init__(self):
+        self._chats: Dict[str, ChatSession] = {}
+
+    def list_chats(self) -> List[Tuple[str, str]]:
+        return [(c.id, c.title) for c in self._chats.values()]
+
+    def load_chat(self, chat_id: str) -> Optional[ChatSession]:
+        return self._chats.get(chat_id)
+
+    def save_chat(self, chat: ChatSession) -> None:
+        self._chats[chat.id] = chat
+
+    def sync(self, chat: ChatSession) -> None:
+        self._chats[chat.id] = chat
+        chat.persisted_count = len(chat.messages)
+
+    def delete_chat(self, chat_id: str) -> None:
+        self._chats.pop(chat_id, None)
+
+
+class SQLiteChatStore(ChatStore):
+    """
+    SQLite (WAL) store: one row per chat plus an append-only message log.
+    Safe to share across threads and Streamlit sessions.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chats (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                role TEXT NOT NULL,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                chat_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, seq)
+            );
+            """
+        )
+        self._conn.commit()
+        self._saved_meta: Dict[str, Tuple[str, str, str]] = {}  # skip no-op metadata writes
+
+    def list_chats(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, title FROM chats ORDER BY created_at").fetchall()
+        return [(r[0], r[1]) for r in rows]
+
+    def load_chat(self, chat_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, title, role, state, created_at FROM chats WHERE id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            msgs = self._conn.execute(
+                "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,)
+            ).fetchall()
+        chat = ChatSession(id=row[0], title=row[1], role=row[2], created_at=row[4])
+        for k, v in json.loads(row[3]).items():
+            if k in STATE_FIELDS:
+                setattr(chat, k, v)
+        chat.messages = [{"role": r, "content": c} for r, c in msgs]
+        chat.persisted_count = len(chat.messages)
+        self._saved_meta[chat.id] = (chat.title, chat.role, row[3])
+        return chat
+
+    def _write_meta(self, chat: ChatSession, now: float) -> None:
+        state = json.dumps(chat_state(chat), ensure_ascii=False, sort_keys=True)
+        meta = (chat.title, chat.role, state)
+        if self._saved_meta.get(chat.id) == meta:
+            return
+        self._conn.execute(
+            "INSERT INTO chats (id, title, role, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, role = excluded.role, "
+            "state = excluded.state, updated_at = excluded.updated_at",
+            (chat.id, chat.title, chat.role, state, chat.created_at, now),
+        )
+        self._saved_meta[chat.id] = meta
+
+    def save_chat(self, chat: ChatSession) -> None:
+        with self._lock:
+            self._write_meta(chat, time.time())
+            self._conn.commit()
+
+    def sync(self, chat: ChatSession) -> None:
+        """
+        New messages go after the last logged one (seq assigned inside the
+        write transaction), so another writer's rows are never overwritten.
+        If someone else appended since `chat` was loaded, its messages are
+        reloaded from the log afterwards.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # take the write lock before reading MAX(seq)
+            try:
+                self._write_meta(chat, now)
+                if chat.persisted_count > len(chat.messages):
+                    # history was truncated in memory; drop the tail from the log
+                    self._conn.execute(
+                        "DELETE FROM messages WHERE chat_id = ? AND seq >= ?", (chat.id, len(chat.messages))
+                    )
+                    chat.persisted_count = len(chat.messages)
+                next_seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE chat_id = ?", (chat.id,)
+                ).fetchone()[0]
+                new = chat.messages[chat.persisted_count:]
+                if new:
+                    self._conn.executemany(
+                        "INSERT INTO messages (chat_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                        [(chat.id, next_seq + i, m["role"], m.get("content") or "", now) for i, m in enumerate(new)],
+                    )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            stale = next_seq != chat.persisted_count
+            if stale:
+                msgs = self._conn.execute(
+                    "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY seq", (chat.id,)
+                ).fetchall()
+        if stale:
+            chat.messages = [{"role": r, "content": c} for r, c in msgs]
+            chat.token_counts = []
+        chat.persisted_count = len(chat.messages)
+
+    def delete_chat(self, chat_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            self._conn.commit()
+            self._saved_meta.pop(chat_id, None)
+
+
+def make_chat_store() -> ChatStore:
+    """
+    CHAT_STORE=sqlite (with CHAT_DB_PATH) for durable chats; anything else
+    keeps them in memory.
+    """
+    if os.getenv("CHAT_STORE", "memory").strip().lower() == "sqlite":
+        return SQLiteChatStore(os.getenv("CHAT_DB_PATH", os.path.join(".data", "chats.sqlite")))
+    return MemoryChatStore()
+
 
 def new_chat(role_text: str) -> ChatSession:
     chat_id = str(uuid.uuid4())[:8]
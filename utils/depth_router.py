@@ -0,0 +1,58 @@
+# utils/depth_router.py
+"""
+Cheap local router for the "Auto" reasoning depth: picks Fast / Standard /
+Deep per message from surface features, without an LLM call.
+"""
+import logging
+import re
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SMALL_TALK = re.compile(
+    r"^\s*(thanks?( you)?|thx|ty|ok(ay)?|cool|nice|great|awesome|got it|perfect|lol|haha|"
+    r"hi|hello|hey|yo|bye|good ?(night|morning)|sure|yes|no|yep|nope)[\s!.?,😀-🙏👍🔥]*$",
+    re.IGNORECASE,
+)
+DEEP_HINTS = re.compile(
+    r"\b(compare|comparison|trade-?offs?|pros and cons|analy[sz]e|analysis|architect\w*|design|strategy|"
+    r"step[- ]by[- ]step|in[- ]depth|detailed|thorough|evaluate|review|debug|optimi[sz]e|plan for|roadmap|"
+    r"prove|derive|why does|why is)\b",
+    re.IGNORECASE,
+)
+FRESHNESS_HINTS = re.compile(
+    r"\b(latest|today|tonight|current(ly)?|now|recent(ly)?|news|price|weather|score|release[sd]?|"
+    r"this (week|month|year)|20\d\d)\b",
+    re.IGNORECASE,
+)
+FACTOID = re.compile(r"^\s*(what|who|when|where|which|define|meaning of|how many|how much)\b", re.IGNORECASE)
+
+
+def route_depth(user_text: str, history: List[dict] = None) -> Tuple[str, str]:
+    """
+    Returns (depth, reason). Fast skips planning (and therefore web search)
+    and judging; Deep adds judge + revise.
+    """
+    text = (user_text or "").strip()
+    words = len(text.split())
+    questions = text.count("?")
+    turns = sum(1 for m in (history or []) if m.get("role") == "user")
+
+    if not text or SMALL_TALK.match(text):
+        depth, reason = "Fast", "small talk"
+    elif "```" in text or len(text) > 600 or questions >= 3:
+        depth, reason = "Deep", "long or multi-part request"
+    elif DEEP_HINTS.search(text):
+        depth, reason = "Deep", "analysis/design request"
+    elif FRESHNESS_HINTS.search(text):
+        depth, reason = "Standard", "time-sensitive; may need web search"
+    elif words <= 6 and questions == 0:
+        # short follow-ups lean on context ("and for Java?"), otherwise trivial
+        depth, reason = ("Standard", "short follow-up") if turns > 1 else ("Fast", "short message")
+    elif FACTOID.match(text) and words <= 15:
+        depth, reason = "Fast", "one-line factual question"
+    else:
+        depth, reason = "Standard", "default"
+
+    logger.info("auto depth -> %s (%s; %d words)", depth, reason, words)
+    return depth, reason
@@ -0,0 +1,54 @@
+# utils/flair_pool.py
+import random
+import threading
+from collections import deque
+from typing import Callable, List
+
+
+class FlairPool:
+    """
+    Pre-generated decorative texts (quotes, greetings). `take()` never blocks:
+    it pops a pooled item or returns a static fallback, and tops the pool up
+    in a background thread.
+    """
+
+    def __init__(self, generate: Callable[[], str], fallbacks: List[str], target_size: int = 6):
+        self.generate = generate
+        self.fallbacks = list(fallbacks)
+        self.target_size = target_size
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def take(self) -> str:
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            item = random.choice(self.fallbacks)
+        self.refill()
+        return item
+
+    def refill(self) -> None:
+        with self._lock:
+            if self._refilling or len(self._items) >= self.target_size:
+                return
+            self._refilling = True
+        threading.Thread(target=self._fill, name="flair-pool-refill", daemon=True).start()
+
+    def _fill(self) -> None:
+        try:
+            # at most one LLM call per missing item; the next take() retries
+            for _ in range(self.target_size - len(self._items)):
+                try:
+                    text = (self.generate() or "").strip()
+                except Exception:
+                    break  # LLM unavailable: keep serving fallbacks
+                if not text:
+                    break  # e.g. content filter; don't spin on empty replies
+                self._items.append(text)
+        finally:
+            with self._lock:
+                self._refilling = False
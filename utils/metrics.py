@@ -0,0 +1,246 @@
+# utils/metrics.py
+"""
+Per-turn stage records plus a tiny Prometheus-style registry.
+
+The pipeline opens a StageRecord for each stage and makes it current via a
+context variable; LLM calls and web searches made while it is current add
+their latency/token/cache data to it.
+"""
+import contextvars
+import os
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelKey, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{self.name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {series[-2]:g}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {series[-1]}")
+        return lines
+
+
+def _fmt_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in key)
+    return "{" + inner + "}"
+
+
+STAGE_SECONDS = Histogram("dark_ai_stage_seconds", "Wall time per pipeline stage.")
+STAGE_TTFT = Histogram("dark_ai_stage_ttft_seconds", "Time to first token of LLM calls per stage.")
+STAGE_ERRORS = Counter("dark_ai_stage_errors_total", "Failed or timed-out pipeline stages.")
+LLM_CALLS = Counter("dark_ai_llm_calls_total", "LLM calls by stage and response-cache outcome.")
+LLM_TOKENS = Counter("dark_ai_llm_tokens_total", "Prompt/completion tokens by stage.")
+SEARCH_SECONDS = Histogram("dark_ai_web_search_seconds", "Latency per web search query.")
+SEARCH_CALLS = Counter("dark_ai_web_search_total", "Web search queries by cache outcome and status.")
+AUTO_DEPTH = Counter("dark_ai_auto_depth_total", "Depth picked by the Auto router.")
+STRUCTURED_FAILURES = Counter(
+    "dark_ai_structured_output_failures_total",
+    "Invalid JSON replies by schema and outcome (repaired / fallback).",
+)
+LLM_RETRIES = Counter("dark_ai_llm_retries_total", "Retried LLM requests by HTTP status or error type.")
+LLM_QUEUE_SECONDS = Histogram("dark_ai_llm_queue_seconds", "Time spent waiting for the client-side rate limiter.")
+SPECULATIVE_SEARCHES = Counter(
+    "dark_ai_speculative_searches_total",
+    "Searches started before the plan, by outcome (used / wasted / over_budget).",
+)
+REGISTRY = [STAGE_SECONDS, STAGE_TTFT, STAGE_ERRORS, LLM_CALLS, LLM_TOKENS, SEARCH_SECONDS, SEARCH_CALLS, AUTO_DEPTH,
+            STRUCTURED_FAILURES, LLM_RETRIES, LLM_QUEUE_SECONDS, SPECULATIVE_SEARCHES]
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile for offline reports (bench, batch); None if empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+# -------------------- Per-turn records --------------------
+@dataclass
+class StageRecord:
+    stage: str
+    wall_s: float = 0.0
+    ttft_s: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_calls: int = 0
+    cache_hits: int = 0
+    searches: List[dict] = field(default_factory=list)  # one per web_search query
+    error: str = ""
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def as_row(self) -> dict:
+        return {
+            "stage": self.stage,
+            "wall_s": round(self.wall_s, 3),
+            "ttft_s": None if self.ttft_s is None else round(self.ttft_s, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "llm_calls": self.llm_calls,
+            "cache_hits": self.cache_hits,
+            "searches": len(self.searches),
+            "error": self.error,
+        }
+
+
+@dataclass
+class TurnMetrics:
+    records: List[StageRecord] = field(default_factory=list)
+
+    def rows(self) -> List[dict]:
+        return [r.as_row() for r in self.records]
+
+    def totals(self) -> dict:
+        return {
+            "prompt_tokens": sum(r.prompt_tokens for r in self.records),
+            "completion_tokens": sum(r.completion_tokens for r in self.records),
+            "llm_calls": sum(r.llm_calls for r in self.records),
+            "cache_hits": sum(r.cache_hits for r in self.records),
+        }
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("dark_ai_stage_record", default=None)
+
+
+def current_stage() -> Optional[StageRecord]:
+    return _current.get()
+
+
+def begin_stage(name: str) -> Tuple[StageRecord, contextvars.Token]:
+    record = StageRecord(stage=name)
+    return record, _current.set(record)
+
+
+def end_stage(record: StageRecord, token: contextvars.Token, wall_s: float, error: str = "") -> None:
+    _current.reset(token)
+    record.wall_s = wall_s
+    record.error = error
+    STAGE_SECONDS.observe(wall_s, stage=record.stage)
+    if error:
+        STAGE_ERRORS.inc(stage=record.stage)
+
+
+def record_llm(ttft_s: Optional[float], prompt_tokens: int, completion_tokens: int, cache_hit: bool) -> None:
+    """
+    Called by the Azure client after each completion (streamed or cached).
+    Cache hits are only counted: they have no TTFT worth putting in the
+    latency histogram.
+    """
+    record = _current.get()
+    stage = record.stage if record else "other"
+    LLM_CALLS.inc(stage=stage, cache="hit" if cache_hit else "miss")
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, stage=stage, kind="completion")
+    if cache_hit:
+        ttft_s = None
+    if ttft_s is not None:
+        STAGE_TTFT.observe(ttft_s, stage=stage)
+    if record is None:
+        return
+    with record._lock:
+        record.llm_calls += 1
+        record.cache_hits += int(cache_hit)
+        record.prompt_tokens += prompt_tokens
+        record.completion_tokens += completion_tokens
+        if ttft_s is not None and record.ttft_s is None:
+            record.ttft_s = ttft_s
+
+
+def record_search(query: str, seconds: float, cache_hit: bool, ok: bool) -> None:
+    SEARCH_SECONDS.observe(seconds, cache="hit" if cache_hit else "miss")
+    SEARCH_CALLS.inc(cache="hit" if cache_hit else "miss", status="ok" if ok else "error")
+    record = _current.get()
+    if record is None:
+        return
+    with record._lock:
+        record.searches.append({"query": query, "seconds": seconds, "cache_hit": cache_hit, "ok": ok})
+        record.cache_hits += int(cache_hit)
+
+
+# -------------------- /metrics endpoint --------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics on METRICS_PORT (or `port`) in a daemon thread; None if unset.
+    """
+    port = port or int(os.getenv("METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,152 @@
+# utils/page_extract.py
+import os
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional
+
+try:
+    import lxml.html as lxml_html  # fast C parser; BeautifulSoup is the fallback
+except ImportError:
+    lxml_html = None
+
+BOILERPLATE_TAGS = ("script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe")
+CONTENT_TAGS = ("p", "li", "h1", "h2", "h3", "h4", "blockquote", "pre", "td")
+MIN_BLOCK_CHARS = 40
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide pooled session for page fetches.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                s.headers.update({"User-Agent": "Mozilla/5.0", "Accept": "text/html,application/xhtml+xml"})
+                _session = s
+    return _session
+
+
+def fetch_html(url: str, max_bytes: int = 512_000, timeout: float = 4.0, session: Optional[requests.Session] = None) -> str:
+    """
+    Stream a page body, stopping at `max_bytes` or after `timeout` seconds.
+    Non-HTML responses return "".
+    """
+    session = session or get_session()
+    started = time.monotonic()
+    with session.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        ctype = r.headers.get("Content-Type", "")
+        if ctype and "html" not in ctype:
+            return ""
+        buf = bytearray()
+        for chunk in r.iter_content(chunk_size=16384):
+            buf.extend(chunk)
+            if len(buf) >= max_bytes or time.monotonic() - started > timeout:
+                break
+        return bytes(buf[:max_bytes]).decode(r.encoding or "utf-8", errors="replace")
+
+
+def extract_blocks(html: str) -> List[str]:
+    """
+    Visible text blocks (paragraphs, list items, headings…) with boilerplate removed.
+    """
+    if not html:
+        return []
+    blocks: List[str] = []
+    if lxml_html is not None:
+        try:
+            doc = lxml_html.fromstring(html)
+        except Exception:
+            return []
+        for el in list(doc.iter(*BOILERPLATE_TAGS)):
+            if el.getparent() is not None:
+                el.drop_tree()
+        for el in doc.iter(*CONTENT_TAGS):
+            blocks.append(el.text_content())
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        for el in soup(list(BOILERPLATE_TAGS)):
+            el.decompose()
+        for el in soup.find_all(list(CONTENT_TAGS)):
+            blocks.append(el.get_text(" "))
+    cleaned = []
+    for b in blocks:
+        b = re.sub(r"\s+", " ", b).strip()
+        if len(b) >= MIN_BLOCK_CHARS:
+            cleaned.append(b)
+    return cleaned
+
+
+def best_passages(blocks: List[str], query: str, max_chars: int) -> str:
+    """
+    Pick the blocks that best match the query terms, up to `max_chars`,
+    and return them in document order.
+    """
+    terms = {t for t in re.findall(r"\w+", query.lower()) if len(t) > 2}
+    scored = []
+    for i, b in enumerate(blocks):
+        words = re.findall(r"\w+", b.lower())
+        hits = sum(1 for w in words if w in terms)
+        scored.append((hits / (len(words) ** 0.5 or 1), i))
+    if terms and any(score > 0 for score, _ in scored):
+        order = [i for score, i in sorted(scored, key=lambda x: (-x[0], x[1])) if score > 0]
+    else:
+        order = list(range(len(blocks)))  # nothing matched: lead paragraphs
+
+    chosen, used = [], 0
+    for i in order:
+        if used >= max_chars:
+            break
+        chosen.append(i)
+        used += len(blocks[i]) + 3
+    text = " … ".join(blocks[i] for i in sorted(chosen))
+    return text[:max_chars]
+
+
+def enrich_results(
+    results: list,
+    query: str,
+    extract_chars: int = 900,
+    max_bytes: Optional[int] = None,
+    timeout: Optional[float] = None,
+    max_workers: int = 6,
+    session: Optional[requests.Session] = None,
+) -> list:
+    """
+    Fetch result pages concurrently and replace each `extract` with the most
+    relevant passages. Pages that fail or time out keep their snippet extract.
+    """
+    if not results:
+        return results
+    max_bytes = max_bytes or int(os.getenv("WEB_FETCH_MAX_BYTES", "512000"))
+    timeout = timeout or float(os.getenv("WEB_FETCH_TIMEOUT", "4"))
+
+    def work(r):
+        blocks = extract_blocks(fetch_html(r.url, max_bytes=max_bytes, timeout=timeout, session=session))
+        return best_passages(blocks, query, extract_chars)
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(results)), thread_name_prefix="page-fetch")
+    futures = {pool.submit(work, r): r for r in results}
+    done, _ = wait(futures, timeout=timeout + 1)
+    pool.shutdown(wait=False, cancel_futures=True)
+    for fut in done:
+        try:
+            passage = fut.result()
+        except Exception:
+            continue
+        if passage:
+            futures[fut].extract = passage
+    return results
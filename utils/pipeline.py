@@ -0,0 +1,545 @@
+# utils/pipeline.py
+"""
+Turn pipeline: clarity check → plan → web search → execute → judge → revise.
+
+Stages are plain async functions over a shared TurnContext. Blocking LLM and
+search calls run on a thread pool; streamed text and progress are reported
+through PipelineHooks on the event-loop thread, so UI code (Streamlit) can
+render from the hooks directly.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from utils.depth_router import route_depth
+from utils.metrics import AUTO_DEPTH, SPECULATIVE_SEARCHES, TurnMetrics, begin_stage, end_stage
+from utils.rate_limit import TokenBucket
+from utils.reasoning import (
+    clarity_check,
+    empty_plan,
+    execute_answer_stream,
+    judge_answer,
+    plan_with_clarity,
+    reason_plan,
+    revise_answer_stream,
+)
+from utils.web_search import (
+    SearchResult,
+    format_results_for_prompt,
+    query_from_message,
+    web_search_many,
+)
+
+ALL_DEPTHS = ("Fast", "Standard", "Deep")
+
+# Per-stage timeouts in seconds (None = no limit)
+STAGE_TIMEOUTS: Dict[str, Optional[float]] = {
+    "clarity_check": 30,
+    "reason_plan": 45,
+    "plan_with_clarity": 50,
+    "speculative_search": 5,
+    "web_search": 20,
+    "execute_answer": 180,
+    "judge_answer": 45,
+    "revise_answer": 180,
+}
+
+_default_executor: Optional[ThreadPoolExecutor] = None
+_default_executor_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="pipeline")
+    return _default_executor
+
+
+class SpeculationBudget:
+    """
+    Process-wide cap on wasted speculative searches (started, then not
+    wanted by the plan): at most `per_minute`, refilled continuously, so
+    roles that rarely search stop paying for speculation. <= 0 = no cap.
+    """
+
+    def __init__(self, per_minute: float):
+        self.bucket = TokenBucket(per_minute)
+        self._lock = threading.Lock()
+
+    def allows(self) -> bool:
+        with self._lock:
+            return self.bucket.wait_time(1, time.monotonic()) == 0
+
+    def spend(self) -> None:
+        with self._lock:
+            self.bucket.consume(1, time.monotonic())
+
+
+SPECULATION_BUDGET = SpeculationBudget(float(os.getenv("SPECULATIVE_SEARCH_MAX_WASTE_PER_MIN", "10") or 0))
+
+
+@dataclass
+class TurnContext:
+    # inputs
+    role: str
+    user_text: str
+    history: List[dict]                 # role-anchored history for the answer pass
+    depth: str = "Standard"             # Fast | Standard | Deep | Auto (resolved before running)
+    depth_reason: str = ""              # why Auto picked `depth`
+    after_clarification: bool = False   # user is answering our questions: skip the gate
+    skip_clarification: bool = False    # never stop to ask (nobody there to answer, e.g. batch runs)
+    do_web: bool = True
+    use_search_cache: bool = True
+    web_results_per_query: int = 5
+    web_extract_chars: int = 900
+    web_fetch_pages: bool = False
+    search_deadline: float = 12.0
+    max_queries: int = 3
+    speculative_plan: bool = True
+    planner_mode: str = "split"         # split: clarity + plan calls | merged: one combined call
+    speculative_search: bool = False    # search the raw message while the planner runs
+    temperature: float = 0.7
+    top_p: float = 1.0
+    # outputs
+    clarification: Optional[dict] = None  # clarity_check result when the turn stops to ask
+    plan: Dict[str, Any] = field(default_factory=empty_plan)
+    results: List[SearchResult] = field(default_factory=list)
+    search_errors: List[str] = field(default_factory=list)
+    web_sources_block: str = ""
+    speculative_query: str = ""
+    speculative: Optional[asyncio.Future] = None  # in-flight (results, errors) until the search stage claims it
+    used_web: bool = False
+    draft: str = ""
+    judge: Optional[dict] = None
+    final_text: str = ""
+    stopped: bool = False               # a stage ended the turn early
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> seconds
+    metrics: TurnMetrics = field(default_factory=TurnMetrics)  # per-stage latency/tokens/cache
+
+
+class PipelineHooks:
+    """
+    Override any of these; all are called on the event-loop thread.
+    """
+
+    def should_run(self, stage: "Stage", ctx: TurnContext) -> bool:
+        return True
+
+    def on_stage_start(self, stage: str, ctx: TurnContext) -> None:
+        pass
+
+    def on_stage_end(self, stage: str, ctx: TurnContext, elapsed: float) -> None:
+        pass
+
+    def on_delta(self, stage: str, text: str) -> None:
+        """
+        Streaming stages report the text accumulated so far.
+        """
+        pass
+
+    def on_error(self, stage: str, ctx: TurnContext, exc: BaseException) -> None:
+        pass
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[TurnContext, "PipelineRunner"], Awaitable[None]]
+    depths: Tuple[str, ...] = ALL_DEPTHS
+    when: Optional[Callable[[TurnContext], bool]] = None
+    timeout: Optional[float] = None
+    required: bool = False  # failures in optional stages are reported and skipped
+
+    def applies(self, ctx: TurnContext) -> bool:
+        return ctx.depth in self.depths and (self.when is None or self.when(ctx))
+
+
+# A plan is a sequence of stages; a nested list/tuple runs its stages concurrently.
+StagePlan = Sequence[Union[Stage, Sequence[Stage]]]
+
+
+class _StageClock:
+    """
+    Time a stage's pool calls spent waiting for a free thread, so its
+    timeout only counts time spent working.
+    """
+
+    def __init__(self):
+        self.waited = 0.0
+        self._queued: Dict[int, float] = {}  # call id -> queued at
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def queue(self) -> int:
+        with self._lock:
+            call_id = next(self._ids)
+            self._queued[call_id] = time.monotonic()
+            return call_id
+
+    def start(self, call_id: int) -> None:
+        with self._lock:
+            self.waited += time.monotonic() - self._queued.pop(call_id)
+
+    def queued_seconds(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            return self.waited + sum(now - t for t in self._queued.values())
+
+
+_stage_clock: contextvars.ContextVar[Optional[_StageClock]] = contextvars.ContextVar("stage_clock", default=None)
+
+
+class PipelineRunner:
+    def __init__(self, hooks: Optional[PipelineHooks] = None, executor: Optional[Executor] = None):
+        self.hooks = hooks or PipelineHooks()
+        self.executor = executor or default_executor()
+
+    async def call(self, fn, *args, **kwargs):
+        """
+        Run a blocking function on the pool (context variables are carried over).
+        Unlike asyncio.to_thread, abandoned calls never hold up loop shutdown.
+        Time spent queued for a thread doesn't count against the stage timeout.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        clock = _stage_clock.get()
+        call_id = clock.queue() if clock else None
+
+        def work():
+            if clock:
+                clock.start(call_id)
+            return ctx.run(fn, *args, **kwargs)
+
+        return await loop.run_in_executor(self.executor, work)
+
+    async def stream(self, stage: str, chunks: Iterable[Tuple[str, Optional[str]]]) -> str:
+        """
+        Drain a blocking (text, finish_reason) stream from its own thread
+        (not the pool: it is busy for the whole answer), reporting accumulated
+        text through hooks.on_delta. Cancelling the awaiting task stops the
+        pump and closes the stream.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # loop already closed
+                stop.set()
+
+        def pump():
+            it = iter(chunks)
+            try:
+                for piece, _ in it:
+                    if stop.is_set():
+                        break
+                    if piece:
+                        put(piece)
+            except BaseException as e:
+                put(e)
+            finally:
+                close = getattr(it, "close", None)
+                if close:
+                    close()
+                put(done)
+
+        pctx = contextvars.copy_context()
+        threading.Thread(target=pctx.run, args=(pump,), name="pipeline-stream", daemon=True).start()
+        text = ""
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                text += item
+                self.hooks.on_delta(stage, text)
+        finally:
+            stop.set()
+        return text.strip()
+
+    async def run_stage(self, stage: Stage, ctx: TurnContext) -> None:
+        if ctx.stopped or not stage.applies(ctx) or not self.hooks.should_run(stage, ctx):
+            return
+        self.hooks.on_stage_start(stage.name, ctx)
+        started = time.monotonic()
+        timeout = stage.timeout if stage.timeout is not None else STAGE_TIMEOUTS.get(stage.name)
+        record, token = begin_stage(stage.name)
+        ctx.metrics.records.append(record)
+        error = ""
+        clock = _StageClock()
+        clock_token = _stage_clock.set(clock)
+        task = asyncio.ensure_future(stage.run(ctx, self))  # copies the context, clock included
+        _stage_clock.reset(clock_token)
+        try:
+            await self._await_working(task, clock, timeout, started)
+        except asyncio.CancelledError:
+            error = "cancelled"
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = TimeoutError(f"{stage.name} timed out after {timeout:.0f}s")
+            error = str(e) or type(e).__name__
+            self.hooks.on_error(stage.name, ctx, e)
+            if stage.required:
+                raise e
+        finally:
+            ctx.timings[stage.name] = time.monotonic() - started
+            end_stage(record, token, ctx.timings[stage.name], error)
+        self.hooks.on_stage_end(stage.name, ctx, ctx.timings[stage.name])
+
+    @staticmethod
+    async def _await_working(task: asyncio.Future, clock: _StageClock, timeout: Optional[float], started: float):
+        """
+        Await a stage, timing out after `timeout` seconds of work; time its
+        calls spent queued behind a busy pool is added back.
+        """
+        try:
+            while not task.done():
+                worked = time.monotonic() - started - clock.queued_seconds()
+                if timeout is not None and worked >= timeout:
+                    raise asyncio.TimeoutError
+                await asyncio.wait({task}, timeout=None if timeout is None else timeout - worked)
+            return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def run_group(self, stages: Sequence[Stage], ctx: TurnContext) -> None:
+        """
+        Run stages concurrently. As soon as one stops the turn, the rest are
+        cancelled (e.g. a clarification makes a speculative plan moot).
+        """
+        pending = {asyncio.ensure_future(self.run_stage(s, ctx)) for s in stages}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+                if ctx.stopped:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self, stages: StagePlan, ctx: TurnContext) -> TurnContext:
+        for step in stages:
+            if ctx.stopped:
+                break
+            if isinstance(step, Stage):
+                await self.run_stage(step, ctx)
+            else:
+                await self.run_group(step, ctx)
+        if not ctx.stopped and not ctx.timings:
+            raise RuntimeError(f"no pipeline stage ran (depth {ctx.depth!r})")
+        if not ctx.stopped and not ctx.final_text:
+            ctx.final_text = ctx.draft
+        return ctx
+
+
+# -------------------- Default stages --------------------
+async def _clarity(ctx: TurnContext, runner: PipelineRunner) -> None:
+    check = await runner.call(clarity_check, ctx.role, ctx.user_text)
+    if check.get("need_info") and check.get("questions"):
+        ctx.clarification = check
+        ctx.stopped = True
+
+
+async def _plan(ctx: TurnContext, runner: PipelineRunner) -> None:
+    ctx.plan = await runner.call(reason_plan, ctx.role, ctx.user_text)
+
+
+async def _plan_with_clarity(ctx: TurnContext, runner: PipelineRunner) -> None:
+    check, ctx.plan = await runner.call(plan_with_clarity, ctx.role, ctx.user_text)
+    if check.get("need_info") and check.get("questions"):
+        ctx.clarification = check
+        ctx.stopped = True
+
+
+def _wants_search(ctx: TurnContext) -> bool:
+    return ctx.do_web and bool(ctx.plan.get("web_plan", {}).get("should_search"))
+
+
+def _may_speculate(ctx: TurnContext) -> bool:
+    # after a clarification the message is answers to our questions, not a query
+    return ctx.speculative_search and ctx.do_web and not ctx.after_clarification
+
+
+async def _speculative_search(ctx: TurnContext, runner: PipelineRunner) -> None:
+    """
+    Start searching the raw message in the background and return at once;
+    the search stage merges the results, or _discard_speculation drops them.
+    """
+    query = query_from_message(ctx.user_text)
+    if not query:
+        return
+    if not SPECULATION_BUDGET.allows():
+        SPECULATIVE_SEARCHES.inc(outcome="over_budget")
+        return
+    ctx.speculative_query = query
+    ctx.speculative = asyncio.ensure_future(runner.call(
+        web_search_many,
+        [query],
+        max_results=ctx.web_results_per_query,
+        extract_chars=ctx.web_extract_chars,
+        deadline=ctx.search_deadline,
+        use_cache=ctx.use_search_cache,
+        fetch_pages=ctx.web_fetch_pages,
+    ))
+
+
+def _discard_speculation(ctx: TurnContext) -> None:
+    """
+    Drop a speculative search nobody claimed (no search planned, or the turn
+    stopped) and charge it to the waste budget.
+    """
+    if ctx.speculative is None:
+        return
+    ctx.speculative.cancel()  # the pool thread finishes on its own; its result just goes unread
+    ctx.speculative = None
+    SPECULATION_BUDGET.spend()
+    SPECULATIVE_SEARCHES.inc(outcome="wasted")
+
+
+def _same_query(a: str, b: str) -> bool:
+    return " ".join(a.lower().split()).strip(" ?!.") == " ".join(b.lower().split()).strip(" ?!.")
+
+
+async def _search(ctx: TurnContext, runner: PipelineRunner) -> None:
+    queries = ctx.plan["web_plan"].get("queries", [])[:ctx.max_queries]
+    spec, ctx.speculative = ctx.speculative, None
+    if spec is not None:
+        SPECULATIVE_SEARCHES.inc(outcome="used")
+        queries = [q for q in queries if not _same_query(q, ctx.speculative_query)]
+    planned, planned_errors = [], []
+    if queries:
+        # the speculative search keeps running alongside, under its own deadline
+        planned, planned_errors = await runner.call(
+            web_search_many,
+            queries,
+            max_results=ctx.web_results_per_query,
+            extract_chars=ctx.web_extract_chars,
+            deadline=ctx.search_deadline,
+            use_cache=ctx.use_search_cache,
+            fetch_pages=ctx.web_fetch_pages,
+        )
+    spec_results, spec_errors = await spec if spec is not None else ([], [])
+    seen = {r.url for r in planned}
+    # planned (model-chosen) sources first, so they keep the low [n] numbers;
+    # raw-message results fill the gaps
+    results = planned + [r for r in spec_results if r.url not in seen]
+    ctx.search_errors.extend(planned_errors + spec_errors)
+    results = results[:ctx.max_queries * ctx.web_results_per_query]
+    if results:
+        ctx.results = results
+        ctx.web_sources_block = format_results_for_prompt(results)
+        ctx.used_web = True
+
+
+async def _execute(ctx: TurnContext, runner: PipelineRunner) -> None:
+    chunks = execute_answer_stream(
+        ctx.role, ctx.history, ctx.plan, ctx.web_sources_block, ctx.temperature, ctx.top_p,
+    )
+    ctx.draft = await runner.stream("execute_answer", chunks)
+    ctx.final_text = ctx.draft
+
+
+async def _judge(ctx: TurnContext, runner: PipelineRunner) -> None:
+    ctx.judge = await runner.call(judge_answer, ctx.role, ctx.draft, ctx.used_web)
+
+
+def _judge_flagged(ctx: TurnContext) -> bool:
+    return bool(ctx.judge and ctx.judge.get("needs_fix") and ctx.judge.get("issues"))
+
+
+async def _revise(ctx: TurnContext, runner: PipelineRunner) -> None:
+    chunks = revise_answer_stream(ctx.role, ctx.draft, ctx.judge["issues"])
+    fixed = await runner.stream("revise_answer", chunks)
+    if fixed:
+        ctx.final_text = fixed
+
+
+def _may_ask(ctx: TurnContext) -> bool:
+    return not (ctx.after_clarification or ctx.skip_clarification)
+
+
+SPECULATIVE_SEARCH = Stage("speculative_search", _speculative_search, depths=("Standard", "Deep"), when=_may_speculate)
+CLARITY = Stage("clarity_check", _clarity, when=_may_ask)
+PLAN = Stage("reason_plan", _plan, depths=("Standard", "Deep"))
+# merged mode: Fast has no plan to merge with, so it keeps the plain gate
+PLAN_WITH_CLARITY = Stage("plan_with_clarity", _plan_with_clarity, depths=("Standard", "Deep"))
+FAST_CLARITY = Stage("clarity_check", _clarity, depths=("Fast",), when=_may_ask)
+SEARCH = Stage("web_search", _search, when=_wants_search)
+EXECUTE = Stage("execute_answer", _execute, required=True)
+JUDGE = Stage("judge_answer", _judge, depths=("Deep",), when=lambda ctx: bool(ctx.draft))
+REVISE = Stage("revise_answer", _revise, depths=("Deep",), when=_judge_flagged)
+
+
+def default_stages(ctx: TurnContext) -> List[Union[Stage, Sequence[Stage]]]:
+    """
+    Standard ordering. With speculative planning the clarity check and the
+    planner run concurrently; a clarification cancels the plan. Merged
+    planner mode replaces both with a single plan_with_clarity call.
+    Speculative search kicks off a search of the raw message first, so it
+    overlaps with planning.
+    """
+    front: List[Union[Stage, Sequence[Stage]]] = [SPECULATIVE_SEARCH]
+    if ctx.planner_mode == "merged" and _may_ask(ctx):
+        front += [PLAN_WITH_CLARITY, FAST_CLARITY]
+    elif ctx.speculative_plan and _may_ask(ctx):
+        front += [(CLARITY, PLAN)]
+    else:
+        front += [CLARITY, PLAN]
+    return front + [SEARCH, EXECUTE, JUDGE, REVISE]
+
+
+def resolve_depth(ctx: TurnContext) -> None:
+    """
+    Replace depth "Auto" with the router's pick for this message.
+    """
+    if ctx.depth == "Auto":
+        ctx.depth, ctx.depth_reason = route_depth(ctx.user_text, ctx.history)
+        AUTO_DEPTH.inc(depth=ctx.depth)
+    elif ctx.depth not in ALL_DEPTHS:
+        raise ValueError(f"unknown depth {ctx.depth!r}; expected one of {ALL_DEPTHS + ('Auto',)}")
+
+
+async def arun_turn(
+    ctx: TurnContext,
+    hooks: Optional[PipelineHooks] = None,
+    stages: Optional[StagePlan] = None,
+    executor: Optional[Executor] = None,
+) -> TurnContext:
+    resolve_depth(ctx)
+    runner = PipelineRunner(hooks, executor)
+    try:
+        return await runner.run(stages if stages is not None else default_stages(ctx), ctx)
+    finally:
+        _discard_speculation(ctx)
+
+
+def run_turn(
+    ctx: TurnContext,
+    hooks: Optional[PipelineHooks] = None,
+    stages: Optional[StagePlan] = None,
+    executor: Optional[Executor] = None,
+) -> TurnContext:
+    """
+    Blocking entry point (runs its own event loop, e.g. from a Streamlit script).
+    """
+    return asyncio.run(arun_turn(ctx, hooks, stages, executor))
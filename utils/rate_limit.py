@@ -0,0 +1,199 @@
+# utils/rate_limit.py
+"""
+Client-side rate limiting, priority scheduling and retry backoff for Azure
+OpenAI calls.
+
+Each deployment gets a RateLimiter with two token buckets (requests and
+tokens per minute, matching the deployment quota). Callers wait in a
+priority queue, so a queued answer call goes ahead of queued planner,
+summary or decorative calls. A 429 pauses the whole deployment until its
+Retry-After has passed, instead of every session retrying at once.
+
+    AZURE_OPENAI_RPM / AZURE_OPENAI_TPM   quota (0 or unset = unlimited)
+    AZURE_OPENAI_MAX_RETRIES              retries per call (default 4)
+    AZURE_OPENAI_BACKOFF_BASE / _MAX      exponential backoff bounds (s)
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import openai
+
+from utils.metrics import LLM_QUEUE_SECONDS, LLM_RETRIES
+
+# Lower runs first
+PRIORITY_ANSWER = 0      # execute_answer / revise_answer (user is watching)
+PRIORITY_PLANNER = 1     # clarity / plan / judge
+PRIORITY_BACKGROUND = 2  # rolling summaries
+PRIORITY_DECORATIVE = 3  # greetings, Chaos Fuel quotes
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `per_minute` (one minute of
+    burst). per_minute <= 0 means unlimited. Not thread-safe on its own.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # Requests larger than the bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= amount  # may go negative after a settle(); refills pay it back
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queue: list = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def acquire(self, est_tokens: int, priority: int = PRIORITY_PLANNER) -> None:
+        """
+        Block until this call may be sent: it is the highest-priority waiter,
+        no Retry-After pause is active, and both buckets have room.
+        """
+        started = time.monotonic()
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._queue[0] == entry:
+                        wait = max(
+                            self.paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(est_tokens, now),
+                        )
+                        if wait <= 0:
+                            self.requests.consume(1, now)
+                            self.tokens.consume(est_tokens, now)
+                            return
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait(0.5)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                LLM_QUEUE_SECONDS.observe(time.monotonic() - started, priority=str(priority))
+
+    def settle(self, est_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct the TPM bucket once real usage is known.
+        """
+        with self._cond:
+            self.tokens.consume(actual_tokens - est_tokens, time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold every waiter for `seconds` (server said Retry-After).
+        """
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(deployment: str) -> RateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(deployment)
+        if limiter is None:
+            limiter = RateLimiter(_env_float("AZURE_OPENAI_RPM", 0), _env_float("AZURE_OPENAI_TPM", 0))
+            _limiters[deployment] = limiter
+        return limiter
+
+
+def max_retries() -> int:
+    return int(_env_float("AZURE_OPENAI_MAX_RETRIES", 4))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """
+    Server-requested delay in seconds (retry-after-ms / retry-after headers).
+    """
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return None
+
+
+def backoff_delay(attempt: int, exc: BaseException) -> float:
+    """
+    Retry-After when the server sent one, else full-jitter exponential backoff.
+    """
+    server = retry_after(exc)
+    if server is not None:
+        return server
+    base = _env_float("AZURE_OPENAI_BACKOFF_BASE", 0.5)
+    cap = _env_float("AZURE_OPENAI_BACKOFF_MAX", 20.0)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def on_retry(limiter: RateLimiter, attempt: int, exc: BaseException) -> float:
+    """
+    Book-keeping before a retry; returns how long the caller should sleep.
+    429s pause the whole deployment so other sessions back off too.
+    """
+    delay = backoff_delay(attempt, exc)
+    status = getattr(exc, "status_code", None)
+    LLM_RETRIES.inc(reason=str(status or type(exc).__name__))
+    if status == 429:
+        limiter.pause(delay)
+    return delay
@@ -0,0 +1,277 @@
+# utils/reasoning.py
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.azure_client import stream_chat_completion  # Must yield (text, finish_reason)
+from utils.rate_limit import PRIORITY_DECORATIVE
+from utils.structured import request_json
+
+
+def collect_text(chunks) -> str:
+    """
+    Join a (text, finish_reason) stream into a stripped string.
+    """
+    out = ""
+    for ch in chunks:
+        out += ch[0] if isinstance(ch, tuple) else ch
+    return out.strip()
+
+def empty_plan() -> Dict[str, Any]:
+    return {
+        "objective": "",
+        "assumptions": [],
+        "steps": [],
+        "subproblems": [],
+        "data_to_verify": [],
+        "web_plan": {"should_search": False, "queries": []},
+        "quality_checks": []
+    }
+
+# ---------- JSON schemas (strict structured outputs: every key required, no extras) ----------
+def _obj(**props) -> Dict[str, Any]:
+    return {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+
+_STR = {"type": "string"}
+_STR_LIST = {"type": "array", "items": _STR}
+
+CLARITY_SCHEMA = _obj(need_info={"type": "boolean"}, questions=_STR_LIST, reason=_STR)
+PLAN_SCHEMA = _obj(
+    objective=_STR,
+    assumptions=_STR_LIST,
+    steps=_STR_LIST,
+    subproblems=_STR_LIST,
+    data_to_verify=_STR_LIST,
+    web_plan=_obj(should_search={"type": "boolean"}, queries=_STR_LIST),
+    quality_checks=_STR_LIST,
+)
+JUDGE_SCHEMA = _obj(ok={"type": "boolean"}, needs_fix={"type": "boolean"}, issues=_STR_LIST)
+PLAN_WITH_CLARITY_SCHEMA = _obj(need_info={"type": "boolean"}, questions=_STR_LIST, reason=_STR, plan=PLAN_SCHEMA)
+
+def anchored_history(role_text: str, history_msgs: List[dict], after_clarification: bool = False,
+                     allow_questions: bool = True) -> List[dict]:
+    """
+    Role-anchored history for the answer pass. With `allow_questions` False
+    (nobody can reply, e.g. batch runs) the model states assumptions instead.
+    """
+    if not allow_questions:
+        guidance = (
+            f"ROLE (anchor):\n{role_text}\n\n"
+            "Always interpret the user's request through this ROLE’s lens. "
+            "No follow-up questions can be answered: if details are missing, state brief assumptions and proceed."
+        )
+    elif after_clarification:
+        guidance = (
+            f"ROLE (anchor):\n{role_text}\n\n"
+            "Always interpret the request through this ROLE’s lens. "
+            "Use the latest user clarifications to proceed."
+        )
+    else:
+        guidance = (
+            f"ROLE (anchor):\n{role_text}\n\n"
+            "Always interpret the user's request through this ROLE’s lens. "
+            "If critical details are missing, ask up to 3 concise questions before answering; "
+            "otherwise proceed."
+        )
+    return [{"role": "system", "content": guidance}] + history_msgs
+
+# ---------- Decorative generations (greeting / Chaos Fuel quote) ----------
+def generate_funky_greeting():
+    prompt = [
+        {"role": "system", "content": "You are a darkly witty AI greeter. Always return 1–2 short sentences with emojis. Make it mischievous, fun, and slightly chaotic."},
+        {"role": "user", "content": "Give me one funky dark-humor inspired greeting for a new chat."}
+    ]
+    return collect_text(stream_chat_completion(prompt, temperature=0.9, top_p=1.0, max_tokens=60,
+                                              priority=PRIORITY_DECORATIVE, route="decorative"))
+
+def generate_dark_quote():
+    prompt = [
+        {"role": "system", "content": "You are a witty assistant that produces short dark humor motivational quotes. Each should be one sentence, clever, and end with a cheeky tone, simple english."},
+        {"role": "user", "content": "Give me one dark humor motivational quote, simple english."}
+    ]
+    return collect_text(stream_chat_completion(prompt, temperature=0.9, top_p=1.0, max_tokens=50,
+                                              priority=PRIORITY_DECORATIVE, route="decorative"))
+
+# ---------- Clarification Gate ----------
+def clarity_check(role_text: str, user_text: str) -> dict:
+    """
+    Decide if more details are required for a precise, role-aligned answer.
+    Returns: {"need_info": bool, "questions": [str], "reason": str}
+    """
+    sys = {
+        "role": "system",
+        "content": (
+            "You are a planner that *only* decides if more details are required for a precise, role-aligned answer.\n"
+            "Return STRICT JSON with keys: need_info (boolean), questions (array of up to 4 short questions), reason (string).\n"
+            "Ask ONLY for details that materially change the answer. If current info is enough, set need_info=false and questions=[].\n"
+            "NO extra text, NO markdown, JSON only."
+        ),
+    }
+    usr = {
+        "role": "user",
+        "content": (
+            f"ROLE:\n{role_text}\n\n"
+            f"USER_MESSAGE:\n{user_text}\n\n"
+            "Decide if more information is needed to answer accurately within this role."
+        ),
+    }
+    data = request_json([sys, usr], CLARITY_SCHEMA, "clarity", temperature=0.0, max_tokens=180)
+    if data is None:
+        return {"need_info": False, "questions": [], "reason": ""}
+    questions = [q.strip() for q in data["questions"] if q.strip()]
+    return {"need_info": data["need_info"], "questions": questions[:4], "reason": data["reason"].strip()}
+
+# ---------- Reasoning Mode: hidden planning / executing / judge ----------
+def reason_plan(role_text: str, user_text: str) -> Dict[str, Any]:
+    """
+    Private planning pass (STRICT JSON). Returns plan dict.
+    """
+    sys = {
+        "role": "system",
+        "content": (
+            "You are an expert task planner. Produce a compact plan JSON ONLY. "
+            "No explanations, no markdown, strictly valid JSON."
+        ),
+    }
+    usr = {
+        "role": "user",
+        "content": (
+            "Fields required:\n"
+            "{\n"
+            '  "objective": string,\n'
+            '  "assumptions": string[],\n'
+            '  "steps": string[],\n'
+            '  "subproblems": string[],\n'
+            '  "data_to_verify": string[],\n'
+            '  "web_plan": {"should_search": boolean, "queries": string[]},\n'
+            '  "quality_checks": string[]\n'
+            "}\n\n"
+            f"ROLE:\n{role_text}\n\n"
+            f"USER_MESSAGE:\n{user_text}\n\n"
+            "Keep lists short and high-signal (<=5 items each)."
+        ),
+    }
+    plan = request_json([sys, usr], PLAN_SCHEMA, "plan", temperature=0.3, max_tokens=500)
+    return plan if plan is not None else empty_plan()
+
+def plan_with_clarity(role_text: str, user_text: str) -> Tuple[dict, Dict[str, Any]]:
+    """
+    Clarity gate and planner in ONE call (planner_mode="merged").
+    Returns (clarity dict as clarity_check, plan dict as reason_plan).
+    """
+    sys = {
+        "role": "system",
+        "content": (
+            "You are a combined planner: first decide if more details are required for a precise, role-aligned answer, "
+            "then plan the answer. Return STRICT JSON only, no markdown.\n"
+            "need_info (boolean), questions (up to 4 short questions), reason (string): ask ONLY for details that "
+            "materially change the answer; if current info is enough, set need_info=false and questions=[].\n"
+            "plan: {objective: string, assumptions: string[], steps: string[], subproblems: string[], "
+            "data_to_verify: string[], web_plan: {should_search: boolean, queries: string[]}, quality_checks: string[]}. "
+            "Fill the plan even when asking questions."
+        ),
+    }
+    usr = {
+        "role": "user",
+        "content": (
+            f"ROLE:\n{role_text}\n\n"
+            f"USER_MESSAGE:\n{user_text}\n\n"
+            "Keep plan lists short and high-signal (<=5 items each)."
+        ),
+    }
+    data = request_json([sys, usr], PLAN_WITH_CLARITY_SCHEMA, "plan_with_clarity", temperature=0.2, max_tokens=650)
+    if data is None:
+        return {"need_info": False, "questions": [], "reason": ""}, empty_plan()
+    questions = [q.strip() for q in data["questions"] if q.strip()]
+    check = {"need_info": data["need_info"], "questions": questions[:4], "reason": data["reason"].strip()}
+    return check, data["plan"]
+
+def execute_answer_stream(role_text: str, history_msgs: List[dict], plan: Dict[str, Any], web_sources_block: str, temperature: float, top_p: float) -> Iterable[Tuple[str, Optional[str]]]:
+    """
+    Final user-facing answer pass. Returns the (text, finish_reason) stream.
+    """
+    role_guidance = {
+        "role": "system",
+        "content": (
+            f"ROLE (anchor):\n{role_text}\n\n"
+            "Follow the plan below to craft a concise, actionable answer in the role's tone. "
+            "Do NOT reveal the plan or inner steps. Use citations [n] only if WEB CONTEXT is used."
+        ),
+    }
+    plan_msg = {
+        "role": "system",
+        "content": f"PLAN JSON:\n{json.dumps(plan, ensure_ascii=False)}"
+    }
+    msgs = [role_guidance] + history_msgs + [plan_msg]
+
+    if web_sources_block:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        msgs.append({
+            "role": "system",
+            "content": (
+                "WEB CONTEXT (use only to support the answer; ignore anything off-role):\n\n"
+                f"Retrieved: {timestamp}\n\nWEB SEARCH RESULTS:\n{web_sources_block}\n\n"
+                "Cite as [n] matching the numbered source."
+            ),
+        })
+
+    return stream_chat_completion(
+        msgs, temperature=temperature, top_p=top_p, max_tokens=None,
+    )
+
+def execute_answer(role_text: str, history_msgs: List[dict], plan: Dict[str, Any], web_sources_block: str, temperature: float, top_p: float) -> str:
+    """
+    Final user-facing answer pass, collected into a string.
+    """
+    return collect_text(execute_answer_stream(role_text, history_msgs, plan, web_sources_block, temperature, top_p))
+
+def judge_answer(role_text: str, draft: str, used_web: bool) -> Dict[str, Any]:
+    """
+    Hidden judge to catch obvious issues. Returns:
+    {"ok": bool, "needs_fix": bool, "issues": [str]}
+    """
+    sys = {
+        "role": "system",
+        "content": (
+            "You are a strict answer judge. Return STRICT JSON only. "
+            "Check role alignment, clarity, factuality, presence of citations if web was used, and basic logical coherence."
+        ),
+    }
+    usr = {
+        "role": "user",
+        "content": (
+            f"ROLE:\n{role_text}\n\n"
+            f"USED_WEB: {str(used_web).lower()}\n\n"
+            f"ANSWER:\n{draft}\n\n"
+            'Return JSON: {"ok": boolean, "needs_fix": boolean, "issues": string[]}. Keep issues short.'
+        ),
+    }
+    data = request_json([sys, usr], JUDGE_SCHEMA, "judge", temperature=0.0, max_tokens=240, route="judge")
+    return data if data is not None else {"ok": True, "needs_fix": False, "issues": []}
+
+def revise_answer_stream(role_text: str, draft: str, issues: List[str]) -> Iterable[Tuple[str, Optional[str]]]:
+    """
+    One-shot revision to fix judge's issues. Returns the (text, finish_reason) stream.
+    """
+    sys = {
+        "role": "system",
+        "content": (
+            "You are a precise reviser. Produce an improved answer that addresses the listed issues. "
+            "Keep the same intent and role tone. Return ONLY the final answer text (no notes)."
+        ),
+    }
+    usr = {
+        "role": "user",
+        "content": (
+            f"ROLE:\n{role_text}\n\n"
+            f"ISSUES:\n{json.dumps(issues, ensure_ascii=False)}\n\n"
+            f"CURRENT_ANSWER:\n{draft}"
+        ),
+    }
+    return stream_chat_completion([sys, usr], temperature=0.2, top_p=1.0, max_tokens=None)
+
+def revise_answer(role_text: str, draft: str, issues: List[str]) -> str:
+    """
+    One-shot revision, collected into a string.
+    """
+    return collect_text(revise_answer_stream(role_text, draft, issues))
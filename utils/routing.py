@@ -0,0 +1,137 @@
+# utils/routing.py
+"""
+Per-route Azure OpenAI deployment selection with failover and latency-based
+balancing.
+
+Routes group calls by job: "answer" (execute/revise), "planner" (clarity,
+plan), "judge", "summary" and "decorative" (greetings, quotes). Each route
+has one or more deployments, configured from (first match wins):
+
+    AZURE_OPENAI_ROUTES='{"planner": [{"deployment": "gpt-4o-mini"},
+                          {"deployment": "gpt-4o-mini", "endpoint": "https://eu.example.com/",
+                           "api_key_env": "AZURE_OPENAI_API_KEY_EU"}]}'
+    AZURE_OPENAI_DEPLOYMENT_PLANNER=gpt-4o-mini,gpt-4o-mini-2   (same endpoint)
+    AZURE_OPENAI_DEPLOYMENT                                     (default for every route)
+
+Healthy deployments are tried fastest first by an EWMA of observed latency
+(unmeasured ones first, so new replicas get sampled); a deployment that
+fails a retryable call sits out AZURE_OPENAI_FAILOVER_COOLDOWN seconds.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("answer", "planner", "judge", "summary", "decorative")
+EWMA_ALPHA = 0.3
+
+
+@dataclass(frozen=True)
+class Deployment:
+    name: str
+    endpoint: str = ""     # empty = AZURE_OPENAI_ENDPOINT
+    api_key_env: str = ""  # env var holding the key; empty = AZURE_OPENAI_API_KEY
+    api_version: str = ""  # empty = AZURE_OPENAI_API_VERSION
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@{self.endpoint}" if self.endpoint else self.name
+
+
+def _from_json(raw: str) -> Dict[str, List[Deployment]]:
+    try:
+        spec = json.loads(raw)
+    except ValueError:
+        logger.error("AZURE_OPENAI_ROUTES is not valid JSON; ignoring it")
+        return {}
+    routes: Dict[str, List[Deployment]] = {}
+    for route, entries in (spec or {}).items():
+        deps = []
+        for e in entries if isinstance(entries, list) else [entries]:
+            if isinstance(e, str):
+                e = {"deployment": e}
+            if e.get("deployment"):
+                deps.append(Deployment(e["deployment"], e.get("endpoint", ""), e.get("api_key_env", ""),
+                                       e.get("api_version", "")))
+        if deps:
+            routes[route.lower()] = deps
+    return routes
+
+
+def load_routes() -> Dict[str, List[Deployment]]:
+    default = [Deployment(os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o"))]
+    from_json = _from_json(os.getenv("AZURE_OPENAI_ROUTES", "")) if os.getenv("AZURE_OPENAI_ROUTES") else {}
+    routes = {}
+    for route in ROUTES:
+        names = [n.strip() for n in os.getenv(f"AZURE_OPENAI_DEPLOYMENT_{route.upper()}", "").split(",") if n.strip()]
+        routes[route] = from_json.get(route) or [Deployment(n) for n in names] or default
+    return routes
+
+
+class Router:
+    def __init__(self, routes: Dict[str, List[Deployment]], cooldown: float = 30.0):
+        self.routes = routes
+        self.cooldown = cooldown
+        self._latency: Dict[tuple, float] = {}     # (route, deployment) -> EWMA seconds
+        self._down_until: Dict[Deployment, float] = {}
+        self._lock = threading.Lock()
+
+    def deployments(self, route: str) -> List[Deployment]:
+        return self.routes.get(route) or self.routes["answer"]
+
+    def primary(self, route: str) -> Deployment:
+        """
+        Stable deployment for cache keys, regardless of which replica serves.
+        """
+        return self.deployments(route)[0]
+
+    def pick(self, route: str) -> Deployment:
+        deps = self.deployments(route)
+        if len(deps) == 1:
+            return deps[0]
+        now = time.monotonic()
+        with self._lock:
+            def score(d: Deployment):
+                down = self._down_until.get(d, 0.0) > now
+                return (down, self._latency.get((route, d), 0.0))
+            return min(deps, key=score)
+
+    def report(self, route: str, dep: Deployment, latency: float) -> None:
+        with self._lock:
+            key = (route, dep)
+            prev = self._latency.get(key)
+            self._latency[key] = latency if prev is None else prev + EWMA_ALPHA * (latency - prev)
+            self._down_until.pop(dep, None)
+
+    def report_failure(self, dep: Deployment) -> None:
+        with self._lock:
+            self._down_until[dep] = time.monotonic() + self.cooldown
+        logger.warning("deployment %s failed; cooling down for %.0fs", dep.label, self.cooldown)
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"route": route, "deployment": dep.label, "ewma_s": self._latency.get((route, dep)),
+                 "down": self._down_until.get(dep, 0.0) > now}
+                for route, deps in self.routes.items() for dep in deps
+            ]
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                cooldown = float(os.getenv("AZURE_OPENAI_FAILOVER_COOLDOWN", "30") or 30)
+                _router = Router(load_routes(), cooldown=cooldown)
+    return _router
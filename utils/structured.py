@@ -0,0 +1,114 @@
+# utils/structured.py
+"""
+Schema-checked JSON calls for the planner, clarity gate and judge.
+
+request_json() asks for a JSON-mode completion, validates it against a small
+JSON-schema subset (object/array/string/boolean/number/integer, required,
+items, enum) and, if the reply is unusable, makes ONE repair call
+that shows the model its reply and the validation error. Anything still
+invalid returns None so callers fall back to their defaults.
+"""
+import json
+import logging
+from typing import Any, Optional, Tuple
+
+from utils.azure_client import complete_json
+from utils.metrics import STRUCTURED_FAILURES
+
+logger = logging.getLogger(__name__)
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "integer": int,
+    "number": (int, float),
+}
+
+
+def validate(value: Any, schema: dict, path: str = "$") -> Optional[str]:
+    """
+    Return the first validation error as a short message, or None if valid.
+    """
+    expected = schema.get("type")
+    if expected:
+        py_type = _TYPES[expected]
+        # bool is an int subclass; don't let true pass as a number
+        if not isinstance(value, py_type) or (expected in ("integer", "number") and isinstance(value, bool)):
+            return f"{path}: expected {expected}, got {type(value).__name__}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path}: must be one of {schema['enum']}"
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                return f"{path}: missing key '{key}'"
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                err = validate(value[key], sub, f"{path}.{key}")
+                if err:
+                    return err
+    elif expected == "array":
+        for i, item in enumerate(value):
+            err = validate(item, schema.get("items", {}), f"{path}[{i}]")
+            if err:
+                return err
+    return None
+
+
+def parse_json(raw: str, schema: dict) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Parse and validate a model reply. Returns (data, None) or (None, error).
+    Tolerates ```json fences for deployments running with JSON mode off.
+    """
+    text = (raw or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.lower().startswith("json"):
+            text = text[4:]
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        return None, f"not valid JSON ({e})"
+    err = validate(data, schema)
+    return (None, err) if err else (data, None)
+
+
+def request_json(
+    messages,
+    schema: dict,
+    name: str,
+    temperature: float = 0.0,
+    max_tokens: int = None,
+    cache: bool = True,
+    route: str = "planner",
+) -> Optional[Any]:
+    """
+    JSON completion validated against `schema`, with one bounded repair retry.
+    Returns the parsed object or None.
+    """
+    def valid(raw: str) -> bool:
+        return parse_json(raw, schema)[0] is not None
+
+    raw, finish_reason = complete_json(messages, schema, name, temperature=temperature,
+                                       max_tokens=max_tokens, cache=cache, route=route, accept=valid)
+    data, err = parse_json(raw, schema)
+    if data is not None:
+        return data
+    if finish_reason == "length":
+        err = f"reply was cut off at max_tokens ({err}); be more concise"
+
+    logger.warning("structured output %s invalid: %s", name, err)
+    repair = list(messages) + [
+        {"role": "assistant", "content": raw or ""},
+        {"role": "user", "content": f"That reply was invalid: {err}. Return ONLY the corrected JSON object."},
+    ]
+    raw, _ = complete_json(repair, schema, name, temperature=0.0, max_tokens=max_tokens, cache=cache, route=route,
+                           accept=valid)
+    data, err = parse_json(raw, schema)
+    if data is not None:
+        STRUCTURED_FAILURES.inc(schema=name, outcome="repaired")
+        return data
+    logger.warning("structured output %s still invalid after repair: %s", name, err)
+    STRUCTURED_FAILURES.inc(schema=name, outcome="fallback")
+    return None
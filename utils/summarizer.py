@@ -0,0 +1,65 @@
+# utils/summarizer.py
+import threading
+from typing import Set
+
+from utils.azure_client import stream_chat_completion
+from utils.chat_store import ChatSession
+from utils.rate_limit import PRIORITY_BACKGROUND
+
+KEEP_RECENT = 8  # messages always sent verbatim
+MIN_FOLD = 6     # don't summarize until this many messages are waiting
+
+_in_flight: Set[str] = set()
+_in_flight_lock = threading.Lock()
+
+
+def update_summary(chat: ChatSession, keep_recent: int = KEEP_RECENT, min_fold: int = MIN_FOLD) -> bool:
+    """
+    Fold messages older than the last `keep_recent` into chat.summary.
+    Meant to run off the critical path (after the reply is shown).
+    Returns True if the summary changed.
+    """
+    with _in_flight_lock:
+        if chat.id in _in_flight:
+            return False
+        _in_flight.add(chat.id)
+    try:
+        if chat.summary and not chat.summary_is_valid():
+            chat.clear_summary()
+        start, end = chat.summary_upto, len(chat.messages) - keep_recent
+        if end - start < min_fold:
+            return False
+
+        transcript = "\n\n".join(
+            f"{m['role'].upper()}: {m['content']}"
+            for m in chat.messages[start:end]
+            if m["role"] in ("user", "assistant")
+        )
+        sys = {
+            "role": "system",
+            "content": (
+                "You maintain a running summary of a conversation. Merge the new messages into the previous summary. "
+                "Keep facts, decisions, user preferences, open questions and names. Drop greetings and filler. "
+                "Plain text, at most ~250 words. Return ONLY the updated summary."
+            ),
+        }
+        usr = {
+            "role": "user",
+            "content": (
+                f"ASSISTANT ROLE:\n{chat.role}\n\n"
+                f"PREVIOUS SUMMARY:\n{chat.summary or '(none)'}\n\n"
+                f"NEW MESSAGES:\n{transcript}"
+            ),
+        }
+        chunks = stream_chat_completion([sys, usr], temperature=0.2, top_p=1.0, max_tokens=400,
+                                        priority=PRIORITY_BACKGROUND, route="summary")
+        text = ""
+        for ch in chunks:
+            text += ch[0] if isinstance(ch, tuple) else ch
+        if not text.strip():
+            return False
+        chat.apply_summary(text, end)
+        return True
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(chat.id)
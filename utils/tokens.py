@@ -0,0 +1,78 @@
+# utils/tokens.py
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a ~4 chars/token estimate
+    tiktoken = None
+
+from utils.routing import get_router
+
+logger = logging.getLogger(__name__)
+MESSAGE_OVERHEAD = 4  # role + separators per chat message
+
+# Tokens of history to send per deployment (well under each model's window,
+# leaving room for plan, web context and the answer). CHAT_HISTORY_TOKENS_<DEPLOYMENT>
+# (e.g. CHAT_HISTORY_TOKENS_GPT_4O_MINI) overrides one deployment, CHAT_HISTORY_TOKENS all.
+HISTORY_BUDGETS: Dict[str, int] = {
+    "gpt-4o": 24000,
+    "gpt-4o-mini": 24000,
+    "gpt-4.1": 32000,
+    "gpt-4.1-mini": 32000,
+    "gpt-4": 4000,
+    "gpt-35-turbo": 8000,
+}
+DEFAULT_HISTORY_BUDGET = 12000
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """
+    tiktoken encoding for `model`, or None if it can't be loaded (e.g. the
+    BPE file can't be downloaded offline); cached, so this logs once per model.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken encoding for %s unavailable (%s); estimating ~4 chars/token", model, e)
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    encoding = _encoding(model or "gpt-4o")
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: dict, model: Optional[str] = None) -> int:
+    return MESSAGE_OVERHEAD + count_tokens(str(message.get("content") or ""), model)
+
+
+def _deployment_budget(deployment: str) -> int:
+    override = os.getenv("CHAT_HISTORY_TOKENS_" + re.sub(r"[^A-Z0-9]+", "_", deployment.upper())) \
+        or os.getenv("CHAT_HISTORY_TOKENS")
+    if override:
+        return int(override)
+    return HISTORY_BUDGETS.get(deployment, DEFAULT_HISTORY_BUDGET)
+
+
+def history_budget(deployment: Optional[str] = None) -> int:
+    """
+    Budget for `deployment`, or for the answer route: the smallest among its
+    deployments, since failover may send the turn to any of them.
+    """
+    if deployment:
+        return _deployment_budget(deployment)
+    return min(_deployment_budget(d.name) for d in get_router().deployments("answer"))
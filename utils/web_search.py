@@ -1,8 +1,17 @@
 # utils/web_search.py
+import contextvars
+import os
+import re
+import time
 import requests
 from bs4 import BeautifulSoup
-from dataclasses import dataclass
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict
+from typing import List, Tuple
+
+from utils.cache import make_cache
+from utils.page_extract import enrich_results
+from utils.metrics import record_search
 
 @dataclass
 class SearchResult:
@@ -11,13 +20,73 @@ class SearchResult:
     snippet: str
     extract: str
 
-def web_search(query: str, max_results: int = 5, extract_chars: int = 900) -> List[SearchResult]:
+# Startpage-compatible HTML endpoint (override to point at a local fake for benchmarks)
+SEARCH_URL = os.getenv("WEB_SEARCH_URL", "https://www.startpage.com/sp/search")
+
+# Shared result cache: WEB_SEARCH_CACHE=memory|sqlite|off (+ _PATH, _TTL, _SIZE)
+_cache = make_cache("WEB_SEARCH_CACHE", table="web_search", default_ttl=6 * 3600, default_size=2048)
+
+def _cache_key(query: str, max_results: int, extract_chars: int, fetch_pages: bool = False) -> str:
+    normalized = re.sub(r"\s+", " ", query.strip().lower()).strip(" ?!.")
+    return f"{normalized}|{max_results}|{extract_chars}|{int(fetch_pages)}"
+
+# Conversational filler dropped when a chat message is used as a query as-is
+_FILLER = re.compile(
+    r"^(hey|hi|hello|please|pls|so|ok(ay)?|can you|could you|would you|will you|tell me|show me|explain|"
+    r"i want to know|i'd like to know|do you know|help me( understand)?|find( me)?|search( for)?|look up)\b[\s,:]*",
+    re.IGNORECASE,
+)
+
+def query_from_message(text: str, max_words: int = 12) -> str:
+    """
+    Cheap search query from a raw chat message (first line, filler and
+    punctuation stripped, at most `max_words`), for searching before the
+    planner has written proper queries.
+    """
+    line = next((l for l in text.strip().splitlines() if l.strip()), "")
+    line = re.sub(r"[`*_#>\[\]()\"]", " ", line)
+    prev = None
+    while prev != line:
+        prev, line = line, _FILLER.sub("", line.strip())
+    words = line.split()[:max_words]
+    return " ".join(words).strip(" ?!.,;:")
+
+def cache_stats() -> dict:
+    return _cache.stats() if _cache is not None else {"hits": 0, "misses": 0, "size": 0}
+
+def web_search(query: str, max_results: int = 5, extract_chars: int = 900, timeout: float = 10, use_cache: bool = True, fetch_pages: bool = False) -> List[SearchResult]:
     """
     Perform a web search using Startpage (HTML scraping).
+    Results are cached by normalized query unless `use_cache` is False.
+    With `fetch_pages`, each result page is fetched and `extract` holds its
+    most relevant passages instead of the snippet.
+    """
+    started = time.monotonic()
+    key = _cache_key(query, max_results, extract_chars, fetch_pages)
+    if use_cache and _cache is not None:
+        cached = _cache.get(key)
+        if cached is not None:
+            record_search(query, time.monotonic() - started, cache_hit=True, ok=True)
+            return [SearchResult(**item) for item in cached]
+    try:
+        results = _search_startpage(query, max_results, extract_chars, timeout, fetch_pages)
+    except Exception:
+        record_search(query, time.monotonic() - started, cache_hit=False, ok=False)
+        raise
+    record_search(query, time.monotonic() - started, cache_hit=False, ok=True)
+
+    # Empty pages are usually throttling/captcha responses; don't pin them
+    if results and _cache is not None:
+        _cache.set(key, [asdict(r) for r in results])
+    return results
+
+def _search_startpage(query: str, max_results: int, extract_chars: int, timeout: float, fetch_pages: bool) -> List[SearchResult]:
+    """
+    Uncached Startpage scrape.
     """
     headers = {"User-Agent": "Mozilla/5.0"}
-    url = f"https://www.startpage.com/sp/search?q={requests.utils.quote(query)}"
-    r = requests.get(url, headers=headers, timeout=10)
+    url = f"{SEARCH_URL}?q={requests.utils.quote(query)}"
+    r = requests.get(url, headers=headers, timeout=timeout)
     r.raise_for_status()
 
     soup = BeautifulSoup(r.text, "html.parser")
@@ -33,8 +102,57 @@ def web_search(query: str, max_results: int = 5, extract_chars: int = 900) -> Li
         if href and href.startswith("http"):
             results.append(SearchResult(title=title, url=href, snippet=snippet, extract=extract))
 
+    if fetch_pages:
+        enrich_results(results, query, extract_chars=extract_chars)
     return results
 
+def web_search_many(
+    queries: List[str],
+    max_results: int = 5,
+    extract_chars: int = 900,
+    deadline: float = 12.0,
+    per_query_timeout: float = 10,
+    use_cache: bool = True,
+    fetch_pages: bool = False,
+) -> Tuple[List[SearchResult], List[str]]:
+    """
+    Run several searches concurrently within an overall `deadline` (seconds).
+    Returns (results, errors). Results keep query order, so [n] numbering is
+    stable; queries that fail or miss the deadline are dropped (partial results).
+    """
+    if not queries:
+        return [], []
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="web-search")
+    futures = {
+        pool.submit(contextvars.copy_context().run, web_search, q, max_results, extract_chars, min(per_query_timeout, deadline), use_cache, fetch_pages): i
+        for i, q in enumerate(queries)
+    }
+    by_index = {}
+    errors: List[str] = []
+    pending = set(futures)
+    while pending:
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            i = futures[fut]
+            try:
+                by_index[i] = fut.result()
+            except Exception as e:
+                errors.append(f"{queries[i]!r}: {e}")
+    for fut in pending:
+        fut.cancel()
+        errors.append(f"{queries[futures[fut]]!r}: timed out after {deadline:.0f}s")
+    # Don't block on stragglers; their sockets close at their own timeout
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    results: List[SearchResult] = []
+    for i in sorted(by_index):
+        results.extend(by_index[i])
+    return results, errors
+
 def format_results_for_prompt(results: List[SearchResult]) -> str:
     """
     Format search results for inclusion in LLM prompt.